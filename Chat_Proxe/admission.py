@@ -0,0 +1,128 @@
+import asyncio
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.text import normalize_message
+
+class PendingRequest:
+    """A queued message, plus every near-identical message merged into it."""
+
+    def __init__(self, key, text, user, priority):
+        self.key = key
+        self.text = text
+        self.user = user
+        self.priority = priority
+        self.message_count = 1
+        self.enqueued_at = time.monotonic()
+
+class AdmissionScheduler:
+    """
+    Bounded waiting room for mentions while the AI is busy.
+
+    - Near-identical messages (same normalized text) are merged into one entry.
+    - Every user has their own FIFO, capped at max_per_user; users take turns (round robin).
+    - The entry with the highest priority among the users' next entries goes first.
+    - take_batch() pops several entries so one AI request can answer several viewers.
+    """
+
+    def __init__(self, max_pending=100, max_per_user=3):
+        self.max_pending = max_pending
+        self.max_per_user = max_per_user
+        self.user_queues = OrderedDict()  # user -> deque of PendingRequest, in turn order
+        self.by_key = {}
+        self.pending = 0
+        self.ready = asyncio.Event()
+
+        self.submitted = 0
+        self.merged = 0
+        self.rejected = 0
+        self.ai_requests = 0
+        self.answered_messages = 0
+        self.wait_times = deque(maxlen=1000)
+
+    def submit(self, user, text, priority=0):
+        """Queues a message; returns "queued", "merged" or "full"."""
+        self.submitted += 1
+        key = normalize_message(text) or text
+
+        entry = self.by_key.get(key)
+        if entry is not None:
+            entry.message_count += 1
+            entry.priority = max(entry.priority, priority)
+            self.merged += 1
+            return "merged"
+
+        queue = self.user_queues.get(user)
+        if self.pending >= self.max_pending or (queue is not None and len(queue) >= self.max_per_user):
+            self.rejected += 1
+            return "full"
+
+        if queue is None:
+            queue = self.user_queues[user] = deque()
+        entry = PendingRequest(key, text, user, priority)
+        queue.append(entry)
+        self.by_key[key] = entry
+        self.pending += 1
+        self.ready.set()
+        return "queued"
+
+    async def wait(self):
+        """Waits until at least one message is queued."""
+        await self.ready.wait()
+
+    def take_batch(self, max_items):
+        """Pops up to max_items entries in priority / round-robin order."""
+        batch = []
+        while self.user_queues and len(batch) < max_items:
+            # Highest priority wins; ties go to the user who has waited longest for a turn
+            user = max(self.user_queues, key=lambda candidate: self.user_queues[candidate][0].priority)
+            queue = self.user_queues.pop(user)
+            entry = queue.popleft()
+            if queue:
+                self.user_queues[user] = queue  # Back of the line
+            del self.by_key[entry.key]
+            self.pending -= 1
+            batch.append(entry)
+
+        if not self.user_queues:
+            self.ready.clear()
+
+        if batch:
+            now = time.monotonic()
+            self.ai_requests += 1
+            self.answered_messages += sum(entry.message_count for entry in batch)
+            self.wait_times.extend(now - entry.enqueued_at for entry in batch)
+        return batch
+
+    def remove_user(self, user):
+        """Drops a disconnected user's queued entries that nobody else asked for."""
+        queue = self.user_queues.pop(user, None)
+        if not queue:
+            return
+        for entry in queue:
+            if entry.message_count > 1:
+                # Someone else sent the same message; keep it in the shared rotation
+                self.user_queues.setdefault(None, deque()).append(entry)
+                continue
+            del self.by_key[entry.key]
+            self.pending -= 1
+        if not self.user_queues:
+            self.ready.clear()
+
+    def stats(self):
+        waits = sorted(self.wait_times)
+        return {
+            "queue_length": self.pending,
+            "users_waiting": len(self.user_queues),
+            "submitted": self.submitted,
+            "merged": self.merged,
+            "rejected": self.rejected,
+            "ai_requests": self.ai_requests,
+            "coalescing_ratio": self.answered_messages / self.ai_requests if self.ai_requests else 0.0,
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p99": waits[min(len(waits) - 1, int(len(waits) * 0.99))] if waits else 0.0,
+            "wait_max": waits[-1] if waits else 0.0
+        }
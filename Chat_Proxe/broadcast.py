@@ -0,0 +1,105 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "disconnect")
+
+class ClientChannel:
+    """A viewer's bounded outbound queue, drained by its own writer task."""
+
+    def __init__(self, websocket, queue_size):
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.task = None
+
+class Broadcaster:
+    """
+    Fans messages out to viewers without awaiting their sockets.
+
+    Sending only enqueues, so a slow or half-dead viewer never delays the others.
+    When a viewer's queue is full, the slow-consumer policy either drops its oldest
+    message ("drop_oldest") or disconnects it ("disconnect"). A send that takes longer
+    than send_timeout also disconnects the viewer.
+    """
+
+    def __init__(self, queue_size=64, policy="drop_oldest", send_timeout=10):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy {policy!r}, expected one of {SLOW_CONSUMER_POLICIES}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.channels = {}  # websocket -> ClientChannel
+        self.sent = 0
+        self.dropped = 0
+        self.disconnected = 0
+
+    def __len__(self):
+        return len(self.channels)
+
+    def add(self, websocket):
+        channel = ClientChannel(websocket, self.queue_size)
+        channel.task = asyncio.create_task(self._write(channel))
+        self.channels[websocket] = channel
+
+    def remove(self, websocket):
+        channel = self.channels.pop(websocket, None)
+        if channel is not None and channel.task is not asyncio.current_task():
+            channel.task.cancel()
+
+    def send(self, websocket, text):
+        """Queues a message for one viewer."""
+        channel = self.channels.get(websocket)
+        if channel is not None:
+            self._enqueue(channel, text)
+
+    def broadcast(self, text):
+        """Queues a message for every viewer."""
+        for channel in list(self.channels.values()):
+            self._enqueue(channel, text)
+
+    def _enqueue(self, channel, text):
+        if channel.queue.full():
+            self.dropped += 1
+            if self.policy == "disconnect":
+                logger.warning("[SLOW] Disconnecting client with %d queued messages.", channel.queue.qsize())
+                self._disconnect(channel)
+                return
+            channel.queue.get_nowait()
+        channel.queue.put_nowait(text)
+
+    async def _write(self, channel):
+        try:
+            while True:
+                text = await channel.queue.get()
+                await asyncio.wait_for(channel.websocket.send_text(text), self.send_timeout)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("[ERROR] Failed to send to client, dropping it: %r", e)
+            self._disconnect(channel)
+
+    def _disconnect(self, channel):
+        if self.channels.get(channel.websocket) is not channel:
+            return
+        self.disconnected += 1
+        self.remove(channel.websocket)
+        asyncio.create_task(self._close(channel.websocket))
+
+    async def _close(self, websocket):
+        try:
+            await websocket.close(code=1013)  # "Try again later"
+        except Exception:
+            pass
+
+    def stats(self):
+        depths = [channel.queue.qsize() for channel in self.channels.values()]
+        return {
+            "clients": len(self.channels),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "disconnected": self.disconnected
+        }
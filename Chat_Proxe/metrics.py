@@ -0,0 +1,9 @@
+from prometheus_client import Histogram
+
+# Per-stage latency, exposed on /metrics (a histogram observation costs about a microsecond)
+STAGE_SECONDS = Histogram(
+    "shrokai_proxy_stage_seconds",
+    "Time spent in each stage of answering a mention",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
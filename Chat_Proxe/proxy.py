@@ -1,57 +1,134 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Response, WebSocket, WebSocketDisconnect
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from upstream import AIUpstream
+from broadcast import Broadcaster
+from admission import AdmissionScheduler
+from metrics import STAGE_SECONDS
 import asyncio
-import websockets
-import json
+import logging
+import os
+import sys
+import time
+import uuid
 
-# Initialize FastAPI
-app = FastAPI()
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.structured_logging import configure_logging
 
-# List of active WebSocket connections
-active_connections = set()
+# Logging (LOG_LEVEL, LOG_FORMAT; see common/structured_logging.py)
+configure_logging("chat_proxy")
+logger = logging.getLogger(__name__)
 
-# Queue for incoming user requests
-message_queue = asyncio.Queue()
+# Initialize FastAPI
+async def lifespan(app):
+    ai_upstream.start()
+    # Start queue processing in the background
+    task = asyncio.create_task(process_queue())
+    yield
+    task.cancel()
+    await ai_upstream.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# Outbound queue settings for connected viewers
+CLIENT_QUEUE_SIZE = int(os.environ.get("CLIENT_QUEUE_SIZE", 64))  # Messages buffered per viewer
+SLOW_CONSUMER_POLICY = os.environ.get("SLOW_CONSUMER_POLICY", "drop_oldest")  # "drop_oldest" or "disconnect"
+CLIENT_SEND_TIMEOUT = float(os.environ.get("CLIENT_SEND_TIMEOUT", 10))  # Seconds before a stuck viewer is dropped
+
+# Active WebSocket connections, each with its own outbound queue and writer task
+active_connections = Broadcaster(
+    queue_size=CLIENT_QUEUE_SIZE,
+    policy=SLOW_CONSUMER_POLICY,
+    send_timeout=CLIENT_SEND_TIMEOUT
+)
+
+# Admission settings for incoming user requests
+ADMISSION_MAX_PENDING = int(os.environ.get("ADMISSION_MAX_PENDING", 100))  # Distinct messages waiting for the AI
+ADMISSION_MAX_PER_USER = int(os.environ.get("ADMISSION_MAX_PER_USER", 3))  # Waiting messages per viewer
+ADMISSION_BATCH_SIZE = int(os.environ.get("ADMISSION_BATCH_SIZE", 4))  # Messages answered by one AI request
+
+# Queue for incoming user requests (deduplicated, fair across viewers, prioritized)
+message_queue = AdmissionScheduler(max_pending=ADMISSION_MAX_PENDING, max_per_user=ADMISSION_MAX_PER_USER)
 
 # AI Server WebSocket URL
-AI_SERVER_URL = ""
+AI_SERVER_URL = os.environ.get("AI_SERVER_URL", "")
+AI_POOL_SIZE = int(os.environ.get("AI_POOL_SIZE", 1))  # Persistent connections to the AI server
+AI_REQUEST_TIMEOUT = float(os.environ.get("AI_REQUEST_TIMEOUT", 120))  # Seconds to wait for an answer
+
+# Shared, persistent connection(s) to the AI server
+ai_upstream = AIUpstream(AI_SERVER_URL, pool_size=AI_POOL_SIZE, request_timeout=AI_REQUEST_TIMEOUT)
 
 # Global status variables
 is_processing = False  # Is the AI currently processing?
 block_time = 0  # Time to block before accepting the next request
+ai_idle = asyncio.Event()  # Set whenever the previous answer has finished playing
+ai_idle.set()
+playback_finished = asyncio.Event()  # Set by the player through /playback-finished
+
+# Pipelined mode: generate the next answer while the current one plays, release it when playback ends
+PIPELINE_PREFETCH = os.environ.get("PIPELINE_PREFETCH", "0") == "1"
 
 # Messages to users
 WELCOME_MESSAGE = "Mention @ShrokAI, and I’ll respond… probably. If I’m not lost in a mushroom trip."
 BUSY_MESSAGE = "Thinking... but the mushrooms are taking over my brain. Give me a bit more time."
 REQUEST_RECEIVED_MESSAGE = "Got it, let me think about my response."
 
-async def process_queue():
-    """Function to process incoming messages from the queue."""
+# Function to rank messages: direct mentions of the bot go first
+def message_priority(message: str):
+    return 1 if "@shrokai" in message.lower() else 0
+
+# Function to turn a batch of queued mentions into one AI request
+def combine_messages(batch):
+    if len(batch) == 1:
+        return batch[0].text
+    return " | ".join(entry.text for entry in batch)
+
+async def claim_playback():
+    """Waits until the previous answer has finished playing and marks the AI busy."""
     global is_processing
+    await ai_idle.wait()
+    ai_idle.clear()
+    is_processing = True
 
+def release_playback():
+    """Lets the next answer be released."""
+    global is_processing
+    is_processing = False
+    ai_idle.set()
+
+async def process_queue():
+    """Function to process incoming messages from the queue."""
     while True:
-        message, websocket = await message_queue.get()
-
-        # ✅ Mark AI as busy as soon as a request enters processing
-        if is_processing:
-            print("[BUSY] AI is already processing, sending placeholder response to the client.")
-            try:
-                await websocket.send_text(BUSY_MESSAGE)
-            except WebSocketDisconnect:
-                print("[DISCONNECT] Client disconnected during placeholder response.")
-            continue  # Skip processing and wait for the next request
-
-        # AI is now processing
-        is_processing = True
-        print(f"[PROCESSING] AI accepted a new request: {message}")
-
-        # Notify the user that the request has been received
-        try:
-            await websocket.send_text(REQUEST_RECEIVED_MESSAGE)
-        except WebSocketDisconnect:
-            print("[DISCONNECT] Client disconnected during 'Request received' message.")
-
-        # Start processing the request
-        response = await forward_to_ai(message)
+        await message_queue.wait()
+
+        # Without prefetch, nothing is sent to the AI until the previous answer has played
+        if not PIPELINE_PREFETCH:
+            with STAGE_SECONDS.labels("playback_wait").time():
+                await claim_playback()
+
+        # Everything that piled up during the block window is answered together
+        batch = message_queue.take_batch(ADMISSION_BATCH_SIZE)
+        if not batch:
+            if not PIPELINE_PREFETCH:
+                release_playback()
+            continue
+
+        now = time.monotonic()
+        for entry in batch:
+            STAGE_SECONDS.labels("queue_wait").observe(now - entry.enqueued_at)
+
+        message = combine_messages(batch)
+        logger.info("[PROCESSING] AI accepted a new request (%d message(s)): %s", len(batch), message,
+                    extra={"fields": {"batch_size": len(batch)}})
+
+        # Start processing the request (a single viewer keeps their own conversation with the AI)
+        session = batch[0].user if len(batch) == 1 else "crowd"
+        response = await forward_to_ai(message, session=session)
+        delay = block_time
+
+        # With prefetch the answer is ready early; hold it until the previous audio has ended
+        if PIPELINE_PREFETCH:
+            with STAGE_SECONDS.labels("playback_wait").time():
+                await claim_playback()
 
         # Extract only the text response (remove `audio_length`)
         if isinstance(response, dict) and "response" in response:
@@ -59,102 +136,102 @@ async def process_queue():
         else:
             filtered_response = response
 
-        # Broadcast the AI response to all connected users
-        for connection in list(active_connections):
-            try:
-                await connection.send_text(filtered_response)
-            except Exception as e:
-                print(f"[ERROR] Failed to send response to client: {e}")
-                active_connections.remove(connection)
+        # Broadcast the AI response to all connected users (only queues, never waits on a socket)
+        with STAGE_SECONDS.labels("broadcast").time():
+            active_connections.broadcast(filtered_response)
 
-        # Unlock processing for new requests
-        asyncio.create_task(unblock_after_delay())
+        # Unlock processing for new requests once this answer has played
+        playback_finished.clear()
+        asyncio.create_task(unblock_after_delay(delay))
 
-async def forward_to_ai(message: str):
+async def forward_to_ai(message: str, session: str = None):
     """Sends the request to the AI server and retrieves the response."""
     global is_processing, block_time
 
-    print(f"[FORWARD] Sending request to AI: {message}")
+    # The id travels with the request to the AI and on to the TTS server, so their logs can be matched
+    request_id = uuid.uuid4().hex
+    logger.info("[FORWARD] [%s] Sending request to AI: %s", request_id, message)
 
     try:
-        async with websockets.connect(AI_SERVER_URL, ping_interval=10, ping_timeout=None) as ai_ws:
-            await ai_ws.send(message)
-
-            while True:
-                try:
-                    response = await ai_ws.recv()  # 🔥 Wait indefinitely for a response
-                except websockets.ConnectionClosed:
-                    print("[ERROR] AI WebSocket connection unexpectedly closed!")
-                    return "Overdosed on swamp shrooms—brain.exe not found."
-
-                try:
-                    data = json.loads(response)
-                except json.JSONDecodeError:
-                    print(f"[ERROR] Failed to decode JSON: {response}")
-                    return "Overdosed on swamp shrooms—brain.exe not found."
-
-                # 🔥 Ignore "processing" signals and wait for a real response
-                if "processing" in data:
-                    print("[INFO] AI confirmed processing, waiting for a real response...")
-                    continue  
-
-                # Process the actual response
-                if "response" not in data or "audio_length" not in data:
-                    print(f"[ERROR] Invalid JSON response from AI: {data}")
-                    return "Overdosed on swamp shrooms—brain.exe not found."
+        with STAGE_SECONDS.labels("ai_request").time():
+            data = await ai_upstream.request(message, session=session, request_id=request_id)
+    except asyncio.TimeoutError:
+        logger.error("[ERROR] [%s] AI did not answer within %ss!", request_id, AI_REQUEST_TIMEOUT)
+        return "Overdosed on swamp shrooms—brain.exe not found."
+    except Exception as e:
+        logger.error("[ERROR] [%s] Failed to get a response from the AI server: %s", request_id, e)
+        return "Overdosed on swamp shrooms—brain.exe not found."
 
-                block_time = data["audio_length"] + 10  # Block new requests for the specified time
-                print(f"[FORWARD] Received response from AI: {data['response']} (block_time={block_time}s)")
+    # Process the actual response
+    if "response" not in data or "audio_length" not in data:
+        logger.error("[ERROR] [%s] Invalid JSON response from AI: %s", request_id, data)
+        return "Overdosed on swamp shrooms—brain.exe not found."
 
-                return data  # Return the full response
+    block_time = data["audio_length"] + 10  # Block new requests for the specified time
+    logger.info("[FORWARD] [%s] Received response from AI: %s (block_time=%ss)", request_id, data["response"], block_time)
 
-    except Exception as e:
-        print(f"[ERROR] Failed to connect to AI server: {e}")
-        return "Overdosed on swamp shrooms—brain.exe not found."
+    return data  # Return the full response
 
 @app.websocket("/ws/proxy")
 async def proxy_websocket(websocket: WebSocket):
-    global is_processing
     await websocket.accept()
     active_connections.add(websocket)
+    viewer = f"viewer-{uuid.uuid4().hex}"  # Also the AI-side session key; id() values get reused
     
-    print(f"[CONNECT] New client connected ({len(active_connections)} total).")
+    logger.info("[CONNECT] New client connected (%d total).", len(active_connections))
 
     # Send a welcome message
-    await websocket.send_text(WELCOME_MESSAGE)
+    active_connections.send(websocket, WELCOME_MESSAGE)
     
     try:
         while True:
             message = await websocket.receive_text()
-            print(f"[MESSAGE] Received message: {message}")
+            logger.debug("[MESSAGE] Received message: %s", message)
 
-            # ✅ Immediately check AI status and send a placeholder if busy
-            if is_processing:
-                print("[BUSY] AI is currently busy, instantly sending placeholder response.")
-                await websocket.send_text(BUSY_MESSAGE)
-                continue  # Skip adding the request to the queue
-
-            # Add the request to the queue
-            await message_queue.put((message, websocket))
+            # Add the request to the queue; only a full queue gets the placeholder response
+            result = message_queue.submit(viewer, message, priority=message_priority(message))
+            if result == "full":
+                logger.warning("[BUSY] Queue is full, instantly sending placeholder response.")
+                active_connections.send(websocket, BUSY_MESSAGE)
+            else:
+                # Notify the user that the request has been received
+                active_connections.send(websocket, REQUEST_RECEIVED_MESSAGE)
 
     except WebSocketDisconnect:
-        print("[DISCONNECT] Client disconnected.")
-        active_connections.remove(websocket)
+        logger.info("[DISCONNECT] Client disconnected.")
     except Exception as e:
-        print(f"[ERROR] Unexpected error: {e}")
+        logger.error("[ERROR] Unexpected error: %s", e)
         await websocket.close(code=1001)
-
-async def unblock_after_delay():
-    """Function to unlock processing after a delay."""
-    global is_processing
-    print(f"[TIMER] Blocking requests for {block_time} seconds...")
-    await asyncio.sleep(block_time)
-    is_processing = False
-    print("[TIMER] AI is free again, ready to accept new requests.")
-
-# Start queue processing in the background
-asyncio.create_task(process_queue())
+    finally:
+        active_connections.remove(websocket)
+        message_queue.remove_user(viewer)
+
+@app.get("/stats")
+async def stats():
+    """Viewer queue counters and admission queue length, wait times and coalescing ratio."""
+    return {"broadcast": active_connections.stats(), "admission": message_queue.stats()}
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.post("/playback-finished")
+async def report_playback_finished():
+    """Called by the player when the current answer's audio has ended."""
+    playback_finished.set()
+    return {"status": "ok"}
+
+async def unblock_after_delay(delay):
+    """Function to unlock processing when playback ends, or after a delay as a fallback."""
+    logger.info("[TIMER] Blocking requests for up to %s seconds...", delay)
+    try:
+        await asyncio.wait_for(playback_finished.wait(), delay)
+        logger.info("[PLAYBACK] Player reported the answer finished.")
+    except asyncio.TimeoutError:
+        pass
+    release_playback()
+    logger.info("[TIMER] AI is free again, ready to accept new requests.")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=9000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=9000, log_config=None)  # Logging is set up by configure_logging
\ No newline at end of file
@@ -0,0 +1,137 @@
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+import uuid
+import websockets
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class UpstreamConnection:
+    """One long-lived WebSocket to the AI server; replies are routed by request_id."""
+
+    def __init__(self, url, backoff, max_backoff):
+        self.url = url
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.ws = None
+        self.connected = asyncio.Event()
+        self.pending = {}  # request_id -> future waiting for the final reply
+
+    async def run(self):
+        """Keeps the connection open, reconnecting with jittered exponential backoff."""
+        attempt = 0
+        while True:
+            try:
+                connect_start = time.perf_counter()
+                async with websockets.connect(self.url, ping_interval=10, ping_timeout=30) as ws:
+                    STAGE_SECONDS.labels("ai_connect").observe(time.perf_counter() - connect_start)
+                    logger.info("[UPSTREAM] Connected to AI server (%d pending).", len(self.pending))
+                    attempt = 0
+                    self.ws = ws
+                    self.connected.set()
+                    async for raw in ws:
+                        self._dispatch(raw)
+                logger.warning("[UPSTREAM] AI server closed the connection.")
+            except Exception as e:
+                logger.error("[UPSTREAM] AI connection failed: %s", e)
+            finally:
+                self.ws = None
+                self.connected.clear()
+                self._fail_pending(ConnectionError("AI connection lost"))
+
+            delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.5)
+            attempt += 1
+            logger.info("[UPSTREAM] Reconnecting in %.1fs...", delay)
+            await asyncio.sleep(delay)
+
+    def _dispatch(self, raw):
+        try:
+            data = json.loads(raw)
+        except json.JSONDecodeError:
+            logger.error("[ERROR] Failed to decode JSON: %s", raw)
+            return
+        if not isinstance(data, dict):
+            return
+
+        future = self.pending.get(data.get("request_id"))
+        if future is None or future.done():
+            return
+
+        # "processing" frames (including streamed deltas) only mean the AI is still working
+        if "processing" in data:
+            return
+
+        future.set_result(data)
+
+    def _fail_pending(self, error):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+
+    async def request(self, request_id, payload):
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            await self.ws.send(json.dumps(payload))
+            return await future
+        finally:
+            self.pending.pop(request_id, None)
+
+class AIUpstream:
+    """
+    A small pool of persistent connections to the AI server.
+
+    Every request carries a request_id, so many requests can be in flight on the
+    same connection. Connections reconnect on their own; a request waits for a
+    live connection and for its reply up to a per-request timeout.
+    """
+
+    def __init__(self, url, pool_size=1, request_timeout=120, backoff=0.5, max_backoff=30):
+        self.request_timeout = request_timeout
+        self.connections = [UpstreamConnection(url, backoff, max_backoff) for _ in range(pool_size)]
+        self.order = itertools.cycle(self.connections)
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.create_task(connection.run()) for connection in self.connections]
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def _pick(self):
+        """Returns the next connected connection (round robin), waiting for one if needed."""
+        while True:
+            for _ in range(len(self.connections)):
+                connection = next(self.order)
+                if connection.connected.is_set():
+                    return connection
+
+            waiters = [asyncio.create_task(connection.connected.wait()) for connection in self.connections]
+            try:
+                await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+
+    async def request(self, text, session=None, request_id=None, timeout=None):
+        """
+        Sends text to the AI and returns its final JSON reply.
+        Raises asyncio.TimeoutError if no reply arrives within the timeout.
+        """
+        request_id = request_id or uuid.uuid4().hex
+        payload = {"request_id": request_id, "text": text}
+        if session is not None:
+            payload["session"] = session
+
+        async def send_and_wait():
+            connection = await self._pick()
+            return await connection.request(request_id, payload)
+
+        return await asyncio.wait_for(send_and_wait(), timeout or self.request_timeout)
@@ -1,24 +1,135 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from fastapi import FastAPI, Response, WebSocket, WebSocketDisconnect
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+from transformers import AutoTokenizer, AutoModelForCausalLM, DynamicCache
+from transformers.generation.streamers import BaseStreamer
+from concurrent.futures import ThreadPoolExecutor
+from tts_client import TTSClient
+from conversation import ConversationStore
+from response_cache import ResponseCache
+import asyncio
+import copy
 import torch
-import requests
 import json
+import logging
+import os
 import re
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.structured_logging import configure_logging
 
 # Initialize FastAPI
-app = FastAPI()
+async def lifespan(app):
+    # Warm up before accepting traffic so the first user doesn't pay for compilation
+    await asyncio.get_running_loop().run_in_executor(scheduler.executor, warmup)
+    scheduler.start()
+    yield
+    scheduler.stop()
+    await tts_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+# Logging (LOG_LEVEL, LOG_FORMAT; see common/structured_logging.py)
+configure_logging("eleutherai")
+logger = logging.getLogger(__name__)
 
 # Load GPT-Neo Model
 MODEL_NAME = "EleutherAI/gpt-neo-1.3B"
 tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
 if tokenizer.pad_token is None:
     tokenizer.pad_token = tokenizer.eos_token  # Set pad_token as eos_token
+tokenizer.padding_side = "left"  # Batched prompts must end right where generation starts
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = AutoModelForCausalLM.from_pretrained(MODEL_NAME).to(device)
+
+# Inference backend: fp32 (baseline), int8 (dynamic quantized linears, CPU), bf16 (autocast) or compile
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "fp32")
+INFERENCE_BACKENDS = ("fp32", "int8", "bf16", "compile")
+WARMUP_GENERATIONS = int(os.environ.get("WARMUP_GENERATIONS", 2))  # Throwaway generations at startup
+
+# Speculative decoding: a small model with the same tokenizer drafts tokens for GPT-Neo 1.3B to verify
+DRAFT_MODEL_NAME = os.environ.get("DRAFT_MODEL_NAME", "")  # e.g. "EleutherAI/gpt-neo-125M"; empty disables it
+
+def load_model(backend=INFERENCE_BACKEND, name=MODEL_NAME):
+    """Loads a GPT-Neo model and prepares it for the selected inference backend."""
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {INFERENCE_BACKENDS}")
+    if backend == "int8" and device.type != "cpu":
+        raise ValueError("The int8 backend uses dynamic quantization, which only runs on CPU")
+
+    model = AutoModelForCausalLM.from_pretrained(name).to(device)
+    model.eval()
+
+    if backend == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif backend == "compile":
+        # Prompt and batch shapes vary, so compile for dynamic shapes to avoid recompiles
+        model.forward = torch.compile(model.forward, dynamic=True)
+
+    return model
+
+def inference_context():
+    """Autocast context for the bf16 backend; a no-op for the others."""
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=INFERENCE_BACKEND == "bf16")
+
+model = load_model()
+logger.info("Model loaded: %s (%s on %s)", MODEL_NAME, INFERENCE_BACKEND, device)
+
+draft_model = load_model(name=DRAFT_MODEL_NAME) if DRAFT_MODEL_NAME else None
+if draft_model is not None:
+    logger.info("Draft model loaded: %s", DRAFT_MODEL_NAME)
+
+# Forward pass counters used to report how many drafted tokens the main model accepts
+forward_passes = {"model": 0, "draft": 0}
+speculative_stats = {"requests": 0, "proposed": 0, "accepted": 0, "tokens": 0, "model_passes": 0, "seconds": 0.0}
+
+def count_forward_passes(name):
+    def hook(module, inputs, outputs):
+        forward_passes[name] += 1
+    return hook
+
+model.register_forward_hook(count_forward_passes("model"))
+if draft_model is not None:
+    draft_model.register_forward_hook(count_forward_passes("draft"))
 
 # TTS Server URL
-TTS_SERVER_URL = ""
+TTS_SERVER_URL = os.environ.get("TTS_SERVER_URL", "")
+
+# TTS client settings
+TTS_TIMEOUT = float(os.environ.get("TTS_TIMEOUT", 60))  # Seconds to wait for synthesis + upload
+TTS_MAX_CONCURRENCY = int(os.environ.get("TTS_MAX_CONCURRENCY", 4))  # Parallel requests to the TTS server
+TTS_MAX_RETRIES = int(os.environ.get("TTS_MAX_RETRIES", 2))
+
+# Batching settings
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))  # Max prompts per model.generate call
+BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", 25))  # How long to wait for more prompts
+
+# Generation settings
+MAX_PROMPT_TOKENS = 256
+MAX_NEW_TOKENS = 40
+PERSONA_CACHE = os.environ.get("PERSONA_CACHE", "1") == "1"  # Reuse the persona prefix KV cache
+STREAM_RESPONSES = os.environ.get("STREAM_RESPONSES", "0") == "1"  # Push token deltas and per-sentence TTS
+
+# Conversation memory settings
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", 128))  # Tokens of past turns kept per session
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 10000))  # Least recently used sessions are evicted beyond this
+SESSION_IDLE_TIMEOUT = float(os.environ.get("SESSION_IDLE_TIMEOUT", 1800))  # Seconds before an idle session is dropped
+
+# Response cache settings (repeated chat messages like "gm" skip the model and TTS)
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "1") == "1"
+RESPONSE_CACHE_POOL_SIZE = int(os.environ.get("RESPONSE_CACHE_POOL_SIZE", 3))  # Answers sampled per message
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 600))  # Seconds an entry is reused
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 1_000_000))
+
+# Per-stage latency, exposed on /metrics (a histogram observation costs about a microsecond)
+STAGE_SECONDS = Histogram(
+    "shrokai_ai_stage_seconds",
+    "Time spent in each stage of answering a request",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
 
 # Character description for prompt
 character_description = """
@@ -28,6 +139,39 @@ You are a swamp prophet of memecoins, a mushroom-fueled shaman, and a die-hard S
 Try to always answer briefly.
 """
 
+# The persona prefix never changes, so it is tokenized and encoded only once
+persona_prefix = f"{character_description}\n\n"
+persona_ids = tokenizer(persona_prefix)["input_ids"]
+
+def build_persona_cache():
+    """Runs the persona prefix through the model once and returns its past_key_values."""
+    with torch.no_grad(), inference_context():
+        outputs = model(torch.tensor([persona_ids], device=device), use_cache=True)
+    cache = outputs.past_key_values
+    if isinstance(cache, tuple):
+        cache = DynamicCache.from_legacy_cache(cache)
+    return cache
+
+def expand_persona_cache(batch_size):
+    """Returns a private copy of the persona cache for a batch (generate extends it in place)."""
+    cache = copy.deepcopy(persona_cache)
+    if batch_size > 1:
+        cache.batch_repeat_interleave(batch_size)
+    return cache
+
+persona_cache = build_persona_cache() if PERSONA_CACHE else None
+
+# Everything after the persona (history + user turn) has to fit into this many tokens
+PROMPT_BUDGET = MAX_PROMPT_TOKENS - len(persona_ids)
+user_prefix_ids = tokenizer("\nUser:")["input_ids"]
+reply_prefix_ids = tokenizer("\nShrokAI:")["input_ids"]
+
+conversations = ConversationStore(
+    token_budget=HISTORY_TOKEN_BUDGET,
+    max_sessions=MAX_SESSIONS,
+    idle_timeout=SESSION_IDLE_TIMEOUT
+)
+
 # Function to clean text before sending to TTS
 def clean_text_for_tts(text):
     """Removes unnecessary characters from the text and cleans line breaks."""
@@ -45,75 +189,425 @@ def clean_text_for_tts(text):
 
     return cleaned_text.strip()
 
+# Function to tokenize the user's turn; long messages are shortened, never the turn markers
+def build_user_ids(user_input):
+    message_ids = tokenizer(f" {user_input}")["input_ids"]
+    room = PROMPT_BUDGET - len(user_prefix_ids) - len(reply_prefix_ids)
+    return user_prefix_ids + message_ids[:room] + reply_prefix_ids
+
+# Function to build the per-request part of the prompt (everything after the persona)
+def build_prompt_ids(user_ids, conversation=None):
+    if conversation is None:
+        return user_ids
+    return conversation.history_ids(PROMPT_BUDGET - len(user_ids)) + user_ids
+
+# Function to left-pad token id lists into a batch
+def pad_left(sequences):
+    width = max(len(sequence) for sequence in sequences)
+    input_ids = [[tokenizer.pad_token_id] * (width - len(sequence)) + sequence for sequence in sequences]
+    attention_mask = [[0] * (width - len(sequence)) + [1] * len(sequence) for sequence in sequences]
+    return torch.tensor(input_ids, device=device), torch.tensor(attention_mask, device=device)
+
+class BatchStreamer(BaseStreamer):
+    """
+    Incrementally decodes every row of a batched generate call and hands new text
+    to that row's callback. Rows without a callback are not decoded.
+    """
+
+    def __init__(self, callbacks):
+        self.callbacks = callbacks
+        self.tokens = [[] for _ in callbacks]
+        self.sent = [0] * len(callbacks)
+        self.prompt_seen = False
+
+    def put(self, value):
+        # The first call carries the prompt ids, which are not part of the answer
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+
+        for row, token in enumerate(value.reshape(len(self.callbacks), -1).tolist()):
+            if self.callbacks[row] is not None:
+                self.tokens[row].extend(token)
+                self._flush(row, final=False)
+
+    def end(self):
+        for row, callback in enumerate(self.callbacks):
+            if callback is not None:
+                self._flush(row, final=True)
+
+    def _flush(self, row, final):
+        text = tokenizer.decode(self.tokens[row], skip_special_tokens=True)
+        # Hold back incomplete multi-byte characters until the next token completes them
+        if not final and text.endswith("\ufffd"):
+            return
+        delta = text[self.sent[row]:]
+        if delta:
+            self.sent[row] = len(text)
+            self.callbacks[row](delta)
+
+# Function to generate responses for several prompts in one forward pass
+def generate_batch(suffix_ids, max_new_tokens=MAX_NEW_TOKENS, use_persona_cache=PERSONA_CACHE, callbacks=None,
+                   use_draft_model=True):
+    """
+    Runs a single batched model.generate call over left-padded prompts.
+    suffix_ids are the token ids that follow the persona (see build_prompt_ids).
+    With the persona cache only the suffixes are prefilled; the persona keys/values are reused.
+    If callbacks are given, each row's new text is passed to its callback as it is generated.
+    When a draft model is loaded, generation is assisted (speculative) and limited to one prompt.
+    """
+    suffix_ids = [ids[-PROMPT_BUDGET:] for ids in suffix_ids]
+    batch_size = len(suffix_ids)
+
+    assistant_model = draft_model if use_draft_model else None
+    if assistant_model is not None and batch_size > 1:
+        raise ValueError("Speculative decoding only supports a batch size of 1")
+
+    # The draft model builds its own cache from the full prompt, so the persona cache is skipped
+    if use_persona_cache and assistant_model is None:
+        # Padding sits between the persona and the suffix; the mask hides it and
+        # position ids are derived from the mask, so the suffix positions stay correct.
+        suffix_input, suffix_mask = pad_left(suffix_ids)
+        persona_input = torch.tensor([persona_ids] * batch_size, device=device)
+        input_ids = torch.cat([persona_input, suffix_input], dim=1)
+        attention_mask = torch.cat([torch.ones_like(persona_input), suffix_mask], dim=1)
+        past_key_values = expand_persona_cache(batch_size)
+    else:
+        input_ids, attention_mask = pad_left([persona_ids + ids for ids in suffix_ids])
+        past_key_values = None
+
+    streamer = None
+    if callbacks and any(callback is not None for callback in callbacks):
+        streamer = BatchStreamer(callbacks)
+
+    passes_before = dict(forward_passes)
+    start = time.perf_counter()
+
+    with torch.no_grad(), inference_context(), STAGE_SECONDS.labels("generate").time():
+        outputs = model.generate(
+            input_ids,
+            attention_mask=attention_mask,
+            past_key_values=past_key_values,
+            assistant_model=assistant_model,
+            streamer=streamer,
+            max_new_tokens=max_new_tokens,
+            num_return_sequences=1,
+            no_repeat_ngram_size=2,
+            pad_token_id=tokenizer.pad_token_id,
+            do_sample=True,
+            temperature=0.6,
+            top_p=0.9
+        )
+
+    if assistant_model is not None:
+        record_speculative_stats(
+            new_tokens=outputs.shape[1] - input_ids.shape[1],
+            model_passes=forward_passes["model"] - passes_before["model"],
+            draft_passes=forward_passes["draft"] - passes_before["draft"],
+            seconds=time.perf_counter() - start
+        )
+
+    responses = []
+    for output in outputs[:, input_ids.shape[1]:]:
+        response = tokenizer.decode(output, skip_special_tokens=True)
+        responses.append(response.split("ShrokAI:")[-1].strip())
+
+    return responses
+
+# Function to log and accumulate draft acceptance for one assisted generation
+def record_speculative_stats(new_tokens, model_passes, draft_passes, seconds):
+    # Every pass of the main model yields the accepted draft tokens plus one token of its own,
+    # and every draft pass proposes one token
+    accepted = max(new_tokens - model_passes, 0)
+    acceptance_rate = accepted / draft_passes if draft_passes else 0.0
+
+    speculative_stats["requests"] += 1
+    speculative_stats["proposed"] += draft_passes
+    speculative_stats["accepted"] += accepted
+    speculative_stats["tokens"] += new_tokens
+    speculative_stats["model_passes"] += model_passes
+    speculative_stats["seconds"] += seconds
+
+    logger.info("Speculative decoding: %d/%d draft tokens accepted (%.0f%%), %.2f tokens per main-model pass, %.1f tokens/s",
+                accepted, draft_passes, acceptance_rate * 100, new_tokens / max(model_passes, 1), new_tokens / seconds,
+                extra={"fields": {"draft_tokens": draft_passes, "accepted_tokens": accepted, "new_tokens": new_tokens}})
+
 # Function to generate ShrokAI's response
-def generate_shrokai_response(user_input, history):
-    history_context = "\n".join(history[-20:])
-    prompt = f"{character_description}\n\n{history_context}\nUser: {user_input}\nShrokAI:"
-    inputs = tokenizer(prompt, return_tensors="pt", truncation=True, max_length=256).to(device)
-
-    outputs = model.generate(
-        inputs["input_ids"],
-        attention_mask=inputs["attention_mask"],
-        max_new_tokens=40,
-        num_return_sequences=1,
-        no_repeat_ngram_size=2,
-        pad_token_id=tokenizer.pad_token_id,
-        do_sample=True,
-        temperature=0.6,
-        top_p=0.9
-    )
-    response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    response = response.split("ShrokAI:")[-1].strip()
-
-    return response
+def generate_shrokai_response(user_input, conversation=None):
+    return generate_batch([build_prompt_ids(build_user_ids(user_input), conversation)])[0]
+
+# Function to run throwaway generations at the batch sizes the scheduler will use
+def warmup(runs=WARMUP_GENERATIONS):
+    for i in range(runs):
+        batch_size = 1 if i % 2 == 0 else scheduler.max_batch_size
+        generate_batch([build_user_ids("gm")] * batch_size)
+    if runs:
+        logger.info("Warmup finished: %d generation(s)", runs)
+
+class GenerationScheduler:
+    """
+    Collects prompts from concurrent connections and runs them through the model
+    as one batch, so throughput grows with batch size instead of one request per pass.
+    """
+
+    def __init__(self, max_batch_size=BATCH_MAX_SIZE, window_ms=BATCH_WINDOW_MS):
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generate")
+        self.queue = None
+        self.task = None
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, prompt_ids, on_delta=None):
+        """
+        Queues a prompt (from build_prompt_ids) and waits for its response.
+        on_delta is called on the event loop with each new piece of text while generating.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        callback = None
+        if on_delta is not None:
+            callback = lambda delta: loop.call_soon_threadsafe(on_delta, delta)
+        await self.queue.put((prompt_ids, future, callback, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        """Waits for the first prompt, then gathers more until the window closes or the batch is full."""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.window
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Skip requests whose connection went away while waiting
+        return [item for item in batch if not item[1].done()]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+
+            prompts = [prompt for prompt, _, _, _ in batch]
+            callbacks = [callback for _, _, callback, _ in batch]
+            logger.info("Generating batch of %d prompt(s)", len(prompts), extra={"fields": {"batch_size": len(prompts)}})
+
+            now = time.perf_counter()
+            for _, _, _, enqueued_at in batch:
+                STAGE_SECONDS.labels("queue_wait").observe(now - enqueued_at)
+
+            try:
+                responses = await loop.run_in_executor(
+                    self.executor,
+                    lambda: generate_batch(prompts, callbacks=callbacks)
+                )
+            except Exception as e:
+                logger.error("Batch generation failed: %s", e)
+                for _, future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future, _, _), response in zip(batch, responses):
+                if not future.done():
+                    future.set_result(response)
+
+# Assisted generation handles one prompt at a time
+scheduler = GenerationScheduler(max_batch_size=1 if draft_model is not None else BATCH_MAX_SIZE)
+
+tts_client = TTSClient(
+    TTS_SERVER_URL,
+    timeout=TTS_TIMEOUT,
+    max_concurrency=TTS_MAX_CONCURRENCY,
+    max_retries=TTS_MAX_RETRIES
+)
 
 # Function to send text to TTS and receive audio length
-def send_to_tts(text):
+async def send_to_tts(text, request_id=None):
+    with STAGE_SECONDS.labels("tts").time():
+        return await tts_client.synthesize(text, request_id=request_id)
+
+# Function to split streamed text into finished sentences and the unfinished remainder
+def split_sentences(text):
+    *sentences, remainder = re.split(r"(?<=[.!?])\s+", text)
+    return sentences, remainder
+
+# Function to stream a response: token deltas to the client, finished sentences to TTS
+async def stream_response(send, prompt_ids, request_id=None):
+    deltas = asyncio.Queue()
+    sentences = asyncio.Queue()
+
+    async def synthesize():
+        # Sentences are synthesized one after another so audio files keep their order
+        total = 0
+        while (sentence := await sentences.get()) is not None:
+            total += await send_to_tts(sentence, request_id)
+        return total
+
+    tts_task = asyncio.create_task(synthesize())
+    generation = asyncio.create_task(scheduler.submit(prompt_ids, on_delta=deltas.put_nowait))
+    generation.add_done_callback(lambda _: deltas.put_nowait(None))
+
     try:
-        response = requests.post(TTS_SERVER_URL, json={"text": text})
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("audio_length", 0)  # Get audio length
-    except Exception as e:
-        print(f"Error sending to TTS: {e}")
-    return 0
+        pending = ""
+        while (delta := await deltas.get()) is not None:
+            # Delta frames keep the "processing" flag so proxies that don't stream skip them
+            await send({"processing": True, "delta": delta})
 
-# WebSocket endpoint for AI processing
-@app.websocket("/ws/ai")
-async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    
+            finished, pending = split_sentences(pending + delta)
+            for sentence in finished:
+                cleaned_sentence = clean_text_for_tts(sentence)
+                if cleaned_sentence:
+                    sentences.put_nowait(cleaned_sentence)
+
+        response = await generation
+
+        cleaned_tail = clean_text_for_tts(pending)
+        if cleaned_tail:
+            sentences.put_nowait(cleaned_tail)
+    finally:
+        generation.cancel()
+        sentences.put_nowait(None)
+
+    audio_length = await tts_task
+    return clean_text_for_tts(response), audio_length
+
+response_cache = ResponseCache(
+    pool_size=RESPONSE_CACHE_POOL_SIZE,
+    ttl=RESPONSE_CACHE_TTL,
+    max_bytes=RESPONSE_CACHE_MAX_BYTES
+)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return response_cache.stats()
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# Function to read a request: plain text, or JSON with "text" and optional "session" and "request_id"
+def parse_request(message):
     try:
-        while True:
-            message = await websocket.receive_text()
-            print(f"Processing request: {message}")
+        data = json.loads(message)
+    except json.JSONDecodeError:
+        return message, None, None
+    if isinstance(data, dict) and "text" in data:
+        return str(data["text"]), data.get("session"), data.get("request_id")
+    return message, None, None
+
+# Function to answer one request; send() tags every frame with the request id
+async def handle_request(send, text, session_id, request_id=None):
+    with STAGE_SECONDS.labels("request").time():
+        await answer_request(send, text, session_id, request_id)
 
-            # Indicate that processing has started
-            processing_data = json.dumps({"processing": True})
-            await websocket.send_text(processing_data)  
+async def answer_request(send, text, session_id, request_id):
+    conversation = conversations.get(session_id)
+    with STAGE_SECONDS.labels("tokenize").time():
+        user_ids = build_user_ids(text)
 
-            # Generate response from AI
-            response = generate_shrokai_response(message, [])
+    # Indicate that processing has started
+    await send({"processing": True})
 
-            # 🔥 Clean the response before sending to TTS and client
+    cached = response_cache.get(text) if RESPONSE_CACHE else None
+    if cached is not None:
+        # Cache hit: the answer and its audio already exist, skip the model and TTS
+        cleaned_response, audio_length = cached
+        if STREAM_RESPONSES:
+            await send({"processing": True, "delta": cleaned_response})
+    elif STREAM_RESPONSES:
+        # Stream tokens and overlap TTS with the rest of generation
+        prompt_ids = build_prompt_ids(user_ids, conversation)
+        cleaned_response, audio_length = await stream_response(send, prompt_ids, request_id)
+    else:
+        # Generate response from AI (batched with other connections)
+        response = await scheduler.submit(build_prompt_ids(user_ids, conversation))
+
+        # 🔥 Clean the response before sending to TTS and client
+        with STAGE_SECONDS.labels("clean_text").time():
             cleaned_response = clean_text_for_tts(response)
 
-            # Send text to TTS and get audio length
-            audio_length = send_to_tts(cleaned_response)
+        # Send text to TTS and get audio length
+        audio_length = await send_to_tts(cleaned_response, request_id)
+
+    # Only answers that were actually voiced are worth replaying
+    if RESPONSE_CACHE and cached is None and audio_length:
+        response_cache.put(text, cleaned_response, audio_length)
+
+    # Remember the exchange as token ids so the next prompt needs no re-tokenization
+    conversation.append(user_ids + tokenizer(f" {cleaned_response}")["input_ids"])
 
-            # Send JSON response back to proxy
-            response_data = json.dumps({"response": cleaned_response, "audio_length": audio_length})
+    # Send JSON response back to proxy
+    await send({"response": cleaned_response, "audio_length": audio_length})  # 🔥 Send the cleaned response
 
-            await websocket.send_text(response_data)  # 🔥 Send the cleaned response
+    logger.info("[%s] Sent response: %s", request_id, cleaned_response)
+
+# WebSocket endpoint for AI processing
+@app.websocket("/ws/ai")
+async def websocket_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    connection_session = f"connection-{uuid.uuid4().hex}"  # id() values get reused by later connections
+    send_lock = asyncio.Lock()
+    tasks = set()
+
+    async def run_request(message):
+        # Requests without a session id share the memory of their connection
+        text, session_id, request_id = parse_request(message)
+
+        async def send(data):
+            if request_id is not None:
+                data["request_id"] = request_id
+            async with send_lock:
+                await websocket.send_text(json.dumps(data))
+
+        try:
+            await handle_request(send, text, session_id or connection_session, request_id)
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            logger.error("[%s] Error processing request: %s", request_id, e)
+            try:
+                await send({"error": str(e)})
+            except Exception:
+                pass
+
+    try:
+        while True:
+            message = await websocket.receive_text()
+            logger.info("Processing request: %s", message)
 
-            print(f"Sent response: {cleaned_response}")
+            # Each request runs in its own task, so one connection can carry many in-flight requests
+            task = asyncio.create_task(run_request(message))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
 
     except WebSocketDisconnect:
-        print("WebSocket disconnected")
+        logger.info("WebSocket disconnected")
     except Exception as e:
-        print(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
         await websocket.close(code=1001)  # 🔥 Close only if there's an error
+    finally:
+        for task in tasks:
+            task.cancel()
+        conversations.discard(connection_session)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8080, log_config=None)  # Logging is set up by configure_logging
\ No newline at end of file
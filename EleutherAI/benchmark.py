@@ -0,0 +1,176 @@
+"""
+Benchmarks for the ShrokAI generation server.
+
+Loads the same model and settings as app.py, so run it on the box you deploy to:
+
+    python benchmark.py prefix --runs 20 --batch-size 4
+    python benchmark.py backends --modes fp32 int8 bf16 compile
+    python benchmark.py speculative --draft EleutherAI/gpt-neo-125M --runs 20
+"""
+import argparse
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+app = None  # Imported on demand: importing it loads the model
+
+def load_app():
+    global app
+    import app
+
+# Same as app.INFERENCE_BACKENDS; kept here so `backends` doesn't load a model itself
+BACKEND_MODES = ("fp32", "int8", "bf16", "compile")
+
+SAMPLE_MESSAGES = ["gm", "wen moon?", "@ShrokAI what do the mushrooms say about Solana?", "hi Shrok"]
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def rss_mb():
+    """Current resident set size; falls back to the peak where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 2**20
+    except OSError:
+        return peak_rss_mb()
+
+def count_tokens(responses):
+    return sum(len(app.tokenizer(response)["input_ids"]) for response in responses)
+
+def sample_suffixes(batch_size):
+    return [app.build_user_ids(SAMPLE_MESSAGES[i % len(SAMPLE_MESSAGES)]) for i in range(batch_size)]
+
+# Time-to-first-token with and without the persona prefix cache
+def bench_prefix(args):
+    if app.persona_cache is None:
+        app.persona_cache = app.build_persona_cache()
+
+    suffixes = sample_suffixes(args.batch_size)
+    print(f"Persona prefix: {len(app.persona_ids)} tokens, batch size {args.batch_size}")
+
+    for use_cache in (False, True):
+        app.generate_batch(suffixes, max_new_tokens=1, use_persona_cache=use_cache)  # Warmup
+
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            app.generate_batch(suffixes, max_new_tokens=1, use_persona_cache=use_cache)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        label = "with prefix cache" if use_cache else "without prefix cache"
+        print(f"TTFT {label:>22}: mean {statistics.mean(timings):8.1f} ms, "
+              f"p50 {percentile(timings, 50):8.1f} ms, p99 {percentile(timings, 99):8.1f} ms")
+
+# Throughput, latency and memory for each inference backend, each in a fresh process so
+# the memory figures aren't inflated by what earlier modes left in the allocator
+def bench_backends(args):
+    for mode in args.modes:
+        command = [sys.executable, os.path.abspath(__file__), "backend",
+                   "--runs", str(args.runs), "--batch-size", str(args.batch_size), "--warmup", str(args.warmup)]
+        result = subprocess.run(command, env={**os.environ, "INFERENCE_BACKEND": mode})
+        if result.returncode != 0:
+            print(f"{mode:>8}: failed (exit code {result.returncode})")
+
+# One backend, the one app.py loaded at import (INFERENCE_BACKEND); run by `backends`
+def bench_backend(args):
+    app.warmup(args.warmup)
+    startup = time.perf_counter() - args.started
+
+    suffixes = sample_suffixes(args.batch_size)
+    timings = []
+    tokens = 0
+    for _ in range(args.runs):
+        request_start = time.perf_counter()
+        responses = app.generate_batch(suffixes)
+        timings.append((time.perf_counter() - request_start) * 1000)
+        tokens += count_tokens(responses)
+
+    # Peak includes loading: int8 holds the fp32 weights until they are quantized
+    print(f"{app.INFERENCE_BACKEND:>8}: {tokens / (sum(timings) / 1000):7.1f} tokens/s, "
+          f"p50 {percentile(timings, 50):8.1f} ms, p99 {percentile(timings, 99):8.1f} ms, "
+          f"RSS {rss_mb():8.0f} MB (peak {peak_rss_mb():8.0f} MB), load+warmup {startup:6.1f} s")
+
+# Latency and acceptance rate of assisted generation against plain sampling
+def bench_speculative(args):
+    if app.draft_model is None:
+        app.draft_model = app.load_model(name=args.draft)
+        app.draft_model.register_forward_hook(app.count_forward_passes("draft"))
+
+    # Assisted generation can't use the persona prefix cache, so the like-for-like baseline
+    # prefills the whole prompt too; the cached baseline is what the server does without a draft
+    runs = [("baseline", False, False), ("speculative", True, False)]
+    if app.persona_cache is not None:
+        runs.insert(1, ("baseline, prefix cache", False, True))
+
+    results = {}
+    for label, use_draft, use_cache in runs:
+        for key in app.speculative_stats:
+            app.speculative_stats[key] = 0
+        app.generate_batch(sample_suffixes(1), use_persona_cache=use_cache, use_draft_model=use_draft)  # Warmup
+
+        timings = []
+        tokens = 0
+        for i in range(args.runs):
+            suffix = [app.build_user_ids(SAMPLE_MESSAGES[i % len(SAMPLE_MESSAGES)])]
+            start = time.perf_counter()
+            responses = app.generate_batch(suffix, use_persona_cache=use_cache, use_draft_model=use_draft)
+            timings.append((time.perf_counter() - start) * 1000)
+            tokens += count_tokens(responses)
+
+        results[label] = statistics.mean(timings)
+        print(f"{label:>22}: {tokens / (sum(timings) / 1000):7.1f} tokens/s, "
+              f"p50 {percentile(timings, 50):8.1f} ms, p99 {percentile(timings, 99):8.1f} ms")
+
+    stats = app.speculative_stats
+    acceptance_rate = stats["accepted"] / stats["proposed"] if stats["proposed"] else 0.0
+    print(f"Acceptance rate {acceptance_rate:.0%} ({stats['accepted']}/{stats['proposed']}), "
+          f"{stats['tokens'] / max(stats['model_passes'], 1):.2f} tokens per main-model pass, "
+          f"speedup {results['baseline'] / results['speculative']:.2f}x over the same prefill", end="")
+    if "baseline, prefix cache" in results:
+        print(f", {results['baseline, prefix cache'] / results['speculative']:.2f}x over the cached baseline")
+    else:
+        print()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    prefix_parser = subparsers.add_parser("prefix", help="time-to-first-token with/without the persona cache")
+    prefix_parser.add_argument("--runs", type=int, default=20)
+    prefix_parser.add_argument("--batch-size", type=int, default=1)
+    prefix_parser.set_defaults(func=bench_prefix)
+
+    backends_parser = subparsers.add_parser("backends", help="tokens/s, latency and RSS per inference backend")
+    backends_parser.add_argument("--modes", nargs="+", choices=BACKEND_MODES, default=list(BACKEND_MODES))
+    backends_parser.add_argument("--runs", type=int, default=20)
+    backends_parser.add_argument("--batch-size", type=int, default=1)
+    backends_parser.add_argument("--warmup", type=int, default=int(os.environ.get("WARMUP_GENERATIONS", 2)))
+    backends_parser.set_defaults(func=bench_backends)
+
+    backend_parser = subparsers.add_parser("backend", help="one backend, chosen by INFERENCE_BACKEND (used by backends)")
+    backend_parser.add_argument("--runs", type=int, default=20)
+    backend_parser.add_argument("--batch-size", type=int, default=1)
+    backend_parser.add_argument("--warmup", type=int, default=int(os.environ.get("WARMUP_GENERATIONS", 2)))
+    backend_parser.set_defaults(func=bench_backend)
+
+    speculative_parser = subparsers.add_parser("speculative", help="assisted decoding with a draft model vs baseline")
+    speculative_parser.add_argument("--draft", default=os.environ.get("DRAFT_MODEL_NAME") or "EleutherAI/gpt-neo-125M")
+    speculative_parser.add_argument("--runs", type=int, default=20)
+    speculative_parser.set_defaults(func=bench_speculative)
+
+    args = parser.parse_args()
+    args.started = time.perf_counter()
+    if args.func is not bench_backends:
+        load_app()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
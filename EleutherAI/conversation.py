@@ -0,0 +1,74 @@
+import time
+from collections import OrderedDict, deque
+
+class Conversation:
+    """
+    Token ids of one session's past turns, kept in a ring buffer that is trimmed
+    to a token budget (oldest turns go first).
+    """
+
+    def __init__(self, token_budget):
+        self.token_budget = token_budget
+        self.turns = deque()
+        self.token_count = 0
+        self.last_used = time.monotonic()
+
+    def append(self, turn_ids):
+        self.turns.append(turn_ids)
+        self.token_count += len(turn_ids)
+        while self.token_count > self.token_budget and self.turns:
+            self.token_count -= len(self.turns.popleft())
+
+    def history_ids(self, limit):
+        """Returns the most recent whole turns that fit into limit tokens, oldest first."""
+        selected = []
+        total = 0
+        for turn_ids in reversed(self.turns):
+            if total + len(turn_ids) > limit:
+                break
+            selected.append(turn_ids)
+            total += len(turn_ids)
+        return [token for turn_ids in reversed(selected) for token in turn_ids]
+
+class ConversationStore:
+    """
+    Per-session conversation memory. Sessions are kept in LRU order; the least
+    recently used one is dropped when max_sessions is reached, and sessions idle
+    for longer than idle_timeout seconds are dropped on access.
+    """
+
+    def __init__(self, token_budget=128, max_sessions=10000, idle_timeout=1800):
+        self.token_budget = token_budget
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = OrderedDict()
+
+    def get(self, session_id):
+        """Returns the session's conversation, creating it if needed."""
+        now = time.monotonic()
+        self._evict_idle(now)
+
+        conversation = self.sessions.get(session_id)
+        if conversation is None:
+            conversation = Conversation(self.token_budget)
+            self.sessions[session_id] = conversation
+            if len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        else:
+            self.sessions.move_to_end(session_id)
+
+        conversation.last_used = now
+        return conversation
+
+    def discard(self, session_id):
+        self.sessions.pop(session_id, None)
+
+    def _evict_idle(self, now):
+        while self.sessions:
+            conversation = next(iter(self.sessions.values()))
+            if now - conversation.last_used < self.idle_timeout:
+                break
+            self.sessions.popitem(last=False)
+
+    def __len__(self):
+        return len(self.sessions)
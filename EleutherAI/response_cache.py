@@ -0,0 +1,91 @@
+import os
+import random
+import sys
+import time
+from collections import OrderedDict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.text import normalize_message
+
+# Rough per-entry bookkeeping cost on top of the stored strings
+ENTRY_OVERHEAD_BYTES = 200
+
+class CacheEntry:
+    def __init__(self, created):
+        self.created = created
+        self.responses = []  # (response, audio_length) pairs
+        self.size = ENTRY_OVERHEAD_BYTES
+
+class ResponseCache:
+    """
+    LRU + TTL cache of answers to repeated chat messages.
+
+    Each key holds a small pool of previously sampled answers. Until the pool is full
+    lookups miss, so new answers keep being generated; after that a random pooled answer
+    is returned, which keeps replies varied without running the model or TTS.
+    Total size is capped at max_bytes; least recently used keys are evicted first.
+    """
+
+    def __init__(self, pool_size=3, ttl=600, max_bytes=1_000_000):
+        self.pool_size = pool_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, message):
+        """Returns a cached (response, audio_length) pair, or None if the model should run."""
+        key = normalize_message(message)
+        entry = self.entries.get(key)
+
+        if entry is not None and time.monotonic() - entry.created > self.ttl:
+            self._remove(key)
+            entry = None
+
+        if entry is None or len(entry.responses) < self.pool_size:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return random.choice(entry.responses)
+
+    def put(self, message, response, audio_length):
+        key = normalize_message(message)
+        if not key or not response:
+            return
+
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = CacheEntry(time.monotonic())
+            entry.size += sys.getsizeof(key)
+            self.entries[key] = entry
+            self.size += entry.size
+        elif len(entry.responses) >= self.pool_size:
+            return
+
+        added = sys.getsizeof(response)
+        entry.responses.append((response, audio_length))
+        entry.size += added
+        self.size += added
+        self.entries.move_to_end(key)
+
+        while self.size > self.max_bytes and self.entries:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= entry.size
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
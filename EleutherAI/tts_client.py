@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import random
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Failures where the TTS server never handled the request, so sending it again is safe.
+# Read timeouts are not retried: the server may still finish and upload the audio.
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
+RETRYABLE_STATUS = {502, 503, 504}
+
+class TTSClient:
+    """
+    Async client for the TTS server's /generate endpoint.
+
+    Keeps a pool of keep-alive connections, retries requests that never reached the
+    server with jittered exponential backoff and limits concurrent syntheses.
+    Pass transport (e.g. httpx.ASGITransport) to run it against a local stand-in app.
+    """
+
+    def __init__(self, url, timeout=60.0, connect_timeout=5.0, max_concurrency=4,
+                 max_retries=2, backoff=0.5, transport=None):
+        self.url = url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            transport=transport
+        )
+
+    async def synthesize(self, text, request_id=None):
+        """
+        Sends text to the TTS server and returns the audio length in seconds (0 on failure).
+        request_id is passed along so the TTS server's logs can be matched to the request.
+        """
+        payload = {"text": text}
+        if request_id is not None:
+            payload["request_id"] = request_id
+
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await self.client.post(self.url, json=payload)
+                    if response.status_code == 200:
+                        return response.json().get("audio_length", 0)
+                    if response.status_code not in RETRYABLE_STATUS:
+                        logger.error("[%s] TTS request failed with status %d: %s", request_id, response.status_code, response.text)
+                        return 0
+                    error = f"status {response.status_code}"
+                except RETRYABLE_ERRORS as e:
+                    error = repr(e)
+                except Exception as e:
+                    logger.error("[%s] Error sending to TTS: %r", request_id, e)
+                    return 0
+
+                if attempt < self.max_retries:
+                    delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                    logger.warning("[%s] TTS request failed (%s), retrying in %.2fs", request_id, error, delay)
+                    await asyncio.sleep(delay)
+
+            logger.error("[%s] Error sending to TTS after %d attempts: %s", request_id, self.max_retries + 1, error)
+            return 0
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -0,0 +1,308 @@
+"""
+Load tests for the Playlist server, run in-process against fake WebSockets.
+
+    python benchmark.py music --listeners 10000 --duration 600
+    python benchmark.py fanout --clients 10000 --messages 200 --slow 5
+    python benchmark.py moderation --sizes 10 100 1000 10000
+    python benchmark.py logging --clients 100 --write-delay 0.0002
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import re
+import string
+import time
+
+import main
+from common import structured_logging
+from moderation import ModerationEngine
+
+class FakeWebSocket:
+    """
+    Stands in for a Starlette WebSocket: serializes like send_json and counts what it sends.
+    A send_delay makes it a slow client.
+    """
+
+    def __init__(self, send_delay=0):
+        self.send_delay = send_delay
+        self.messages = 0
+        self.bytes = 0
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, data):
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    async def send_text(self, text):
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        self.messages += 1
+        self.bytes += len(text)
+
+    async def close(self, code=1000):
+        pass
+
+async def connect_listeners(manager, count, slow=0, send_delay=0.05):
+    sockets = [FakeWebSocket(send_delay if index < slow else 0) for index in range(count)]
+    for websocket in sockets:
+        await manager.connect(websocket)
+    return sockets
+
+async def drain():
+    """Gives any writer tasks a chance to flush their queues."""
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+def legacy_state(seconds):
+    return {
+        "type": "music",
+        "track": main.current_track_index,
+        "time": seconds,
+        "url": main.playlist[main.current_track_index]
+    }
+
+async def run_legacy(manager, sockets, duration):
+    """The old loop: the full state to every listener once per second."""
+    for second in range(duration):
+        manager.broadcast(legacy_state(second % main.DEFAULT_TRACK_DURATION))
+        await drain()
+
+async def run_event_driven(manager, sockets, duration):
+    """Full state on connect and on track change, plus the low-rate clock sync."""
+    for websocket in sockets:
+        manager.send(websocket, main.music_state())
+    await drain()
+
+    elapsed = 0.0
+    next_clock = main.CLOCK_SYNC_INTERVAL if main.CLOCK_SYNC_INTERVAL > 0 else float("inf")
+    track = 0
+    while True:
+        track_end = elapsed + main.track_durations[track % len(main.playlist)]
+        while next_clock < min(track_end, duration):
+            manager.broadcast({"type": "clock", "track": track, "time": next_clock - elapsed, "server_time": time.time()})
+            await drain()
+            next_clock += main.CLOCK_SYNC_INTERVAL
+        if track_end >= duration:
+            break
+        elapsed = track_end
+        track += 1
+        main.current_track_index = track % len(main.playlist)
+        manager.broadcast(main.music_state())
+        await drain()
+    main.current_track_index = 0
+
+async def measure(name, runner, listeners, duration):
+    manager = main.ConnectionManager()
+    sockets = await connect_listeners(manager, listeners)
+    start_cpu = time.process_time()
+    start_wall = time.perf_counter()
+    await runner(manager, sockets, duration)
+    cpu = time.process_time() - start_cpu
+    wall = time.perf_counter() - start_wall
+    for websocket in sockets:
+        manager.disconnect(websocket)
+    await drain()
+
+    messages = sum(websocket.messages for websocket in sockets)
+    sent_bytes = sum(websocket.bytes for websocket in sockets)
+    print(
+        f"{name:>13}: {messages:>10} messages ({messages / duration:>9.1f}/s), "
+        f"{sent_bytes / 1e6:>8.1f} MB, CPU {cpu:.2f}s ({cpu / duration * 100:.2f}% of one core), wall {wall:.2f}s"
+    )
+
+async def legacy_broadcast(sockets, message):
+    """The old ConnectionManager.broadcast: one send_json (and serialization) per socket, in turn."""
+    for websocket in sockets:
+        await websocket.send_json(message)
+
+async def benchmark_fanout(args):
+    message = {"type": "chat", "username": "viewer", "message": "x" * args.size}
+    deliveries = (args.clients - args.slow) * args.messages
+    print(f"{args.clients} clients ({args.slow} slow), {args.messages} messages of {args.size} characters")
+
+    sockets = [FakeWebSocket(args.send_delay if index < args.slow else 0) for index in range(args.clients)]
+    start = time.perf_counter()
+    for _ in range(args.messages):
+        await legacy_broadcast(sockets, message)
+    legacy = time.perf_counter() - start
+    print(f"   per-socket send_json: {deliveries / legacy:>12.0f} deliveries/s to fast clients")
+
+    manager = main.ConnectionManager()
+    sockets = await connect_listeners(manager, args.clients, args.slow, args.send_delay)
+    fast = sockets[args.slow:]
+    start = time.perf_counter()
+    for _ in range(args.messages):
+        manager.broadcast(message)
+        await drain()
+    while sum(websocket.messages for websocket in fast) < deliveries:
+        await asyncio.sleep(0)
+    engine = time.perf_counter() - start
+    print(f"   encode-once + queues: {deliveries / engine:>12.0f} deliveries/s to fast clients")
+    print(f"   {manager.stats()}")
+
+    for websocket in sockets:
+        manager.disconnect(websocket)
+    await drain()
+
+def random_word(rng):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10)))
+
+def legacy_check(message, banned_words):
+    """The old chat filter: a substring scan per word plus an uncompiled regex."""
+    return any(word in message.lower() for word in banned_words) or re.search(r"http[s]?://\S+", message)
+
+# Clean chat that contains a banned word only inside other words, or once look-alikes are expanded
+FALSE_POSITIVE_WORDS = ["ass", "badi", "hell"]
+FALSE_POSITIVE_MESSAGES = ["straße bad", "that was bad!", "first class seats", "hello there", "Maße nehmen", "sh3ll script"]
+
+def report_false_positives():
+    print(f"Clean messages flagged, banned {FALSE_POSITIVE_WORDS}:")
+    checks = {
+        "substring scan": lambda message: legacy_check(message, FALSE_POSITIVE_WORDS),
+        "automaton": ModerationEngine(FALSE_POSITIVE_WORDS).find_banned_word,
+        "automaton, word boundaries": ModerationEngine(FALSE_POSITIVE_WORDS, word_boundaries=True).find_banned_word
+    }
+    for name, check in checks.items():
+        flagged = [message for message in FALSE_POSITIVE_MESSAGES if check(message)]
+        print(f"   {name + ':':<28}{len(flagged)}/{len(FALSE_POSITIVE_MESSAGES)} {flagged}")
+
+async def benchmark_moderation(args):
+    rng = random.Random(0)
+    # Mostly clean chat, the worst case for a scan that stops at the first hit
+    messages = [" ".join(random_word(rng) for _ in range(rng.randint(3, 15))) for _ in range(args.messages)]
+    print(f"{args.messages} messages, average {sum(map(len, messages)) / len(messages):.0f} characters")
+
+    for size in args.sizes:
+        words = [random_word(rng) for _ in range(size)]
+
+        start = time.perf_counter()
+        for message in messages:
+            legacy_check(message, words)
+        legacy = args.messages / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        engine = ModerationEngine(words, word_boundaries=args.word_boundaries)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for message in messages:
+            engine.find_banned_word(message) is not None or engine.contains_link(message)
+        compiled = args.messages / (time.perf_counter() - start)
+
+        print(f"{size:>7} words: substring scan {legacy:>10.0f} msg/s, automaton {compiled:>10.0f} msg/s (built in {build * 1000:.0f} ms)")
+
+    report_false_positives()
+
+class SlowStream:
+    """A log destination whose writes block, like a console or a log pipe that is backed up."""
+
+    def __init__(self, write_delay):
+        self.write_delay = write_delay
+
+    def write(self, text):
+        if self.write_delay:
+            time.sleep(self.write_delay)
+
+    def flush(self):
+        pass
+
+async def broadcast_rate(clients, messages, size):
+    manager = main.ConnectionManager()
+    sockets = await connect_listeners(manager, clients)
+    message = {"type": "chat", "username": "viewer", "message": "x" * size}
+    start = time.perf_counter()
+    for _ in range(messages):
+        manager.broadcast(message)
+        await drain()
+    elapsed = time.perf_counter() - start
+    for websocket in sockets:
+        manager.disconnect(websocket)
+    await drain()
+    return messages / elapsed
+
+def set_plain_logging(level, stream):
+    structured_logging.stop_logging()
+    root = logging.getLogger()
+    root.handlers = [logging.StreamHandler(stream)] if stream else []
+    root.setLevel(level)
+
+async def benchmark_logging(args):
+    """
+    Broadcasts per second with the per-broadcast log line written by a plain handler on
+    the event loop (the old basicConfig setup) versus the background writer. Best of
+    --rounds, with the setups interleaved so they share the machine's noise. Records the
+    writer has not caught up with are written out between rounds, outside the timing.
+    """
+    print(f"{args.clients} clients, {args.messages} broadcasts of {args.size} characters per round, "
+          f"{args.write_delay * 1e6:.0f} us per log write, best of {args.rounds} rounds")
+    main.logger.setLevel(logging.NOTSET)
+    stream = SlowStream(args.write_delay)
+    setups = {
+        "logging off": lambda: set_plain_logging(logging.WARNING, None),
+        "plain handler, every line": lambda: set_plain_logging(logging.DEBUG, stream),
+        "background JSON, every line": lambda: structured_logging.configure_logging(
+            "playlist", level="DEBUG", stream=stream, rate_limit=0),
+        "background JSON, rate limited": lambda: structured_logging.configure_logging(
+            "playlist", level="DEBUG", stream=stream),
+    }
+
+    best = dict.fromkeys(setups, 0.0)
+    dropped = dict.fromkeys(setups, 0)
+    for _ in range(args.rounds):
+        for name, setup in setups.items():
+            handler = setup()
+            best[name] = max(best[name], await broadcast_rate(args.clients, args.messages, args.size))
+            if handler is not None:
+                dropped[name] += handler.dropped
+    set_plain_logging(logging.WARNING, None)
+
+    for name, rate in best.items():
+        note = f" ({dropped[name]} records dropped)" if dropped[name] else ""
+        print(f"   {name + ':':<31}{rate:>9.0f} broadcasts/s{note}")
+
+async def benchmark_music(args):
+    print(f"{args.listeners} listeners, {args.duration}s of simulated playback, clock sync every {main.CLOCK_SYNC_INTERVAL}s")
+    await measure("1 Hz (before)", run_legacy, args.listeners, args.duration)
+    await measure("event (after)", run_event_driven, args.listeners, args.duration)
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    music = subcommands.add_parser("music", help="Message volume and CPU of music sync")
+    music.add_argument("--listeners", type=int, default=10000)
+    music.add_argument("--duration", type=int, default=600, help="Simulated seconds of playback")
+    music.set_defaults(run=benchmark_music)
+
+    fanout = subcommands.add_parser("fanout", help="Broadcast throughput, old loop vs. encode-once engine")
+    fanout.add_argument("--clients", type=int, default=10000)
+    fanout.add_argument("--messages", type=int, default=200)
+    fanout.add_argument("--size", type=int, default=100, help="Characters per chat message")
+    fanout.add_argument("--slow", type=int, default=0, help="Clients whose every send is delayed")
+    fanout.add_argument("--send-delay", type=float, default=0.05, help="Seconds per send on a slow client")
+    fanout.set_defaults(run=benchmark_fanout)
+
+    moderation = subcommands.add_parser("moderation", help="Chat filter throughput versus banned list size")
+    moderation.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    moderation.add_argument("--messages", type=int, default=5000)
+    moderation.add_argument("--word-boundaries", action="store_true")
+    moderation.set_defaults(run=benchmark_moderation)
+
+    logs = subcommands.add_parser("logging", help="Broadcast throughput with logging off, on the event loop, or in the background")
+    logs.add_argument("--clients", type=int, default=100)
+    logs.add_argument("--messages", type=int, default=2000)
+    logs.add_argument("--size", type=int, default=100, help="Characters per chat message")
+    logs.add_argument("--write-delay", type=float, default=0, help="Seconds each log write blocks (0: free, like /dev/null)")
+    logs.add_argument("--rounds", type=int, default=5)
+    logs.set_defaults(run=benchmark_logging)
+
+    args = parser.parse_args()
+    # Per-message logging would dominate the numbers; keep only warnings
+    logging.getLogger("main").setLevel(logging.WARNING)
+    asyncio.run(args.run(args))
+
+if __name__ == "__main__":
+    main_cli()
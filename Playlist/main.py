@@ -1,16 +1,34 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 import asyncio
+import json
 import logging
-import re
+import socket
 import time
 import os
+import sys
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.structured_logging import configure_logging
+from metrics import STAGE_SECONDS
+from moderation import ModerationEngine
+from pubsub import create_pubsub
 
 # Initialize FastAPI application
 async def lifespan(app):
-    task = asyncio.create_task(broadcast_music_state())
+    pubsub.subscribe("chat", on_remote_chat)
+    pubsub.subscribe("music", on_track_change)
+    pubsub.subscribe("banned_words", on_banned_words)
+    await pubsub.start()
+    await load_shared_state()
+    await load_track_durations()
+    tasks = [asyncio.create_task(run_music_leadership()), asyncio.create_task(broadcast_clock_sync())]
     yield
-    task.cancel()
+    for task in tasks:
+        task.cancel()
+    await pubsub.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -23,8 +41,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Logging
-logging.basicConfig(level=logging.INFO)
+# Logging (LOG_LEVEL, LOG_FORMAT; see common/structured_logging.py)
+configure_logging("playlist")
 logger = logging.getLogger(__name__)
 
 # Playlist
@@ -40,66 +58,292 @@ playlist = [
     "https://od.lk/s/NjBfMTYxNzI5ODAwXw/09.%20Holodeck%20Blues.mp3"
 ]
 
+# Track lengths in seconds, probed with ffprobe at startup; tracks that can't be probed use the default
+DEFAULT_TRACK_DURATION = 180
+track_durations = [DEFAULT_TRACK_DURATION] * len(playlist)
+
+# Seconds between clock-sync messages to music listeners (0 disables them)
+CLOCK_SYNC_INTERVAL = float(os.environ.get("CLOCK_SYNC_INTERVAL", 30))
+
+# Shared by every worker: "memory" for a single worker, or e.g. redis://localhost:6379/0
+PUBSUB_URL = os.environ.get("PUBSUB_URL", "memory")
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+pubsub = create_pubsub(PUBSUB_URL)
+
+# One worker holds this lock and runs the music clock; the others follow its announcements
+MUSIC_LOCK_TTL = float(os.environ.get("MUSIC_LOCK_TTL", 10))
+
 current_track_index = 0
 start_time = time.time()
 
-# Banned words and regex for links
-banned_words = ["bannedword"]
-banned_links_pattern = r"http[s]?://\S+"
+# Banned words, compiled into a moderation engine that also detects links
+MODERATION_WORD_BOUNDARIES = os.environ.get("MODERATION_WORD_BOUNDARIES", "0") == "1"  # Match whole words only
+moderation = ModerationEngine(["bannedword"], MODERATION_WORD_BOUNDARIES)
+moderation_version = 0
+
+# Outbound queue size per client, and how long one send may take before the client is dropped
+CLIENT_QUEUE_SIZE = int(os.environ.get("CLIENT_QUEUE_SIZE", 64))
+CLIENT_SEND_TIMEOUT = float(os.environ.get("CLIENT_SEND_TIMEOUT", 10))
 
 # WebSocket Managers
+def encode_message(message: dict) -> str:
+    # Same encoding as WebSocket.send_json
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
+    """
+    Fans messages out without awaiting any socket.
+
+    A broadcast serializes the message once and queues the same text for every client;
+    each client has a bounded queue drained by its own writer task. A client whose queue
+    fills up, whose send fails or whose send takes longer than send_timeout is evicted.
+    Stalled sends are found by one watchdog task instead of a timer around every send.
+    """
+
+    def __init__(self, queue_size=CLIENT_QUEUE_SIZE, send_timeout=CLIENT_SEND_TIMEOUT):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.active_connections: dict[WebSocket, asyncio.Queue] = {}
+        self.writers: dict[WebSocket, asyncio.Task] = {}
+        self.sending_since: dict[WebSocket, float] = {}
+        self.watchdog = None
+        self.sent = 0
+        self.evicted = 0
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
-        logger.info(f"New connection established. Total connections: {len(self.active_connections)}")
+        self.active_connections[websocket] = asyncio.Queue(maxsize=self.queue_size)
+        self.writers[websocket] = asyncio.create_task(self._write(websocket))
+        if self.watchdog is None:
+            self.watchdog = asyncio.create_task(self._evict_stalled())
+        logger.info("New connection established. Total connections: %d", len(self.active_connections))
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            logger.info(f"Connection closed. Total connections: {len(self.active_connections)}")
-
-    async def broadcast(self, message: dict, sender: WebSocket = None):
-        logger.info(f"Broadcasting message to {len(self.active_connections)} connections: {message}")
-        for connection in self.active_connections:
-            if connection == sender:  # Skip the sender
+        if self.active_connections.pop(websocket, None) is not None:
+            writer = self.writers.pop(websocket)
+            self.sending_since.pop(websocket, None)
+            if writer is not asyncio.current_task():
+                writer.cancel()
+            logger.info("Connection closed. Total connections: %d", len(self.active_connections))
+
+    def send(self, websocket: WebSocket, message: dict):
+        """Queues a message for one client, behind anything already queued for it."""
+        queue = self.active_connections.get(websocket)
+        if queue is not None:
+            self._enqueue(websocket, queue, encode_message(message))
+
+    @STAGE_SECONDS.labels("broadcast").time()
+    def broadcast(self, message: dict, sender: WebSocket = None):
+        text = encode_message(message)
+        logger.debug("Broadcasting message to %d connections: %s", len(self.active_connections), text)
+        for connection, queue in list(self.active_connections.items()):
+            if connection is sender:  # Skip the sender
                 continue
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                logger.error(f"Failed to send message: {e}")
+            self._enqueue(connection, queue, text)
+
+    def _enqueue(self, websocket, queue, text):
+        if queue.full():
+            logger.warning("Client is %d messages behind, evicting it", queue.qsize())
+            self._evict(websocket)
+            return
+        queue.put_nowait(text)
+
+    async def _write(self, websocket: WebSocket):
+        queue = self.active_connections[websocket]
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                text = await queue.get()
+                self.sending_since[websocket] = loop.time()
+                await websocket.send_text(text)
+                self.sending_since.pop(websocket, None)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Failed to send message, evicting client: %r", e)
+            self._evict(websocket)
+
+    async def _evict_stalled(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.send_timeout / 2)
+            deadline = loop.time() - self.send_timeout
+            for websocket, started in list(self.sending_since.items()):
+                if started < deadline:
+                    logger.warning("Send stalled for over %ss, evicting client", self.send_timeout)
+                    self._evict(websocket)
+
+    def _evict(self, websocket):
+        if websocket not in self.active_connections:
+            return
+        self.evicted += 1
+        self.disconnect(websocket)
+        asyncio.create_task(self._close(websocket))
+
+    async def _close(self, websocket):
+        try:
+            await websocket.close(code=1013)  # "Try again later"
+        except Exception:
+            pass
+
+    def stats(self):
+        depths = [queue.qsize() for queue in self.active_connections.values()]
+        return {
+            "clients": len(self.active_connections),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "sent": self.sent,
+            "evicted": self.evicted
+        }
 
 music_manager = ConnectionManager()
 chat_manager = ConnectionManager()
 
 # Music
-async def broadcast_music_state():
+async def probe_duration(url):
+    """Reads a track's duration with ffprobe; returns None if it can't be determined."""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", url,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+        output, _ = await asyncio.wait_for(process.communicate(), timeout=30)
+        return float(output.decode().strip())
+    except Exception as e:
+        logger.warning("Could not probe duration of %s: %s", url, e)
+        return None
+
+async def load_track_durations():
+    durations = await asyncio.gather(*(probe_duration(url) for url in playlist))
+    for index, duration in enumerate(durations):
+        if duration:
+            track_durations[index] = duration
+    logger.info("Track durations: %s", track_durations)
+
+def music_state():
+    """Full sync state: the client seeks to `time` seconds into `url`, as of `server_time`."""
+    return {
+        "type": "music",
+        "track": current_track_index,
+        "time": time.time() - start_time,
+        "duration": track_durations[current_track_index],
+        "server_time": time.time(),
+        "url": playlist[current_track_index]
+    }
+
+async def load_shared_state():
+    """Picks up the current track and banned words from the other workers."""
     global current_track_index, start_time
+    music = await pubsub.get_state("music")
+    if music is not None:
+        current_track_index, start_time = music["track"], music["start_time"]
+    words = await pubsub.get_state("banned_words")
+    if words is not None:
+        await rebuild_moderation(words)
+
+def apply_track_change(change):
+    global current_track_index, start_time
+    current_track_index, start_time = change["track"], change["start_time"]
+    music_manager.broadcast(music_state())
+
+def on_track_change(message):
+    # The clock applies its own changes before publishing them
+    if message.get("origin") != WORKER_ID:
+        apply_track_change(message)
+
+async def run_music_clock():
+    """
+    Advances the playlist when the current track ends and announces each change.
+    Start times are wall-clock, so nodes are expected to keep their clocks in sync (NTP).
+    """
+    change = None  # Applied here but not yet shared with the other workers
     while True:
-        elapsed_time = time.time() - start_time
-        if elapsed_time >= 180:
-            current_track_index = (current_track_index + 1) % len(playlist)
-            start_time = time.time()
-            elapsed_time = 0
-        state = {
-            "type": "music",
+        if change is None:
+            remaining = track_durations[current_track_index] - (time.time() - start_time)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+                continue
+            change = {"track": (current_track_index + 1) % len(playlist), "start_time": time.time()}
+            apply_track_change(change)
+
+        try:
+            await pubsub.set_state("music", change)
+            await pubsub.publish("music", {"origin": WORKER_ID, **change})
+            change = None
+        except Exception as e:
+            logger.error("Could not share track change, retrying: %s", e)
+            await asyncio.sleep(1)
+
+async def start_music_clock():
+    await load_shared_state()
+    if await pubsub.get_state("music") is None:
+        await pubsub.set_state("music", {"track": current_track_index, "start_time": start_time})
+    return asyncio.create_task(run_music_clock())
+
+async def run_music_leadership():
+    """Competes for the music clock lock and runs the clock while holding it."""
+    clock = None
+    try:
+        while True:
+            try:
+                leader = await pubsub.hold_lock("music-clock", WORKER_ID, MUSIC_LOCK_TTL)
+                if leader and (clock is None or clock.done()):
+                    if clock is None:
+                        logger.info("Worker %s is now the music clock", WORKER_ID)
+                    else:
+                        logger.error("Music clock stopped, restarting it: %r", clock.exception())
+                        clock = None
+                    clock = await start_music_clock()
+            except Exception as e:
+                logger.error("Could not run for the music clock lock: %s", e)
+                leader = False
+
+            if not leader and clock is not None:
+                logger.warning("Worker %s lost the music clock lock", WORKER_ID)
+                clock.cancel()
+                clock = None
+
+            await asyncio.sleep(MUSIC_LOCK_TTL / 3)
+    finally:
+        if clock is not None:
+            clock.cancel()
+
+async def broadcast_clock_sync():
+    """Low-rate clock sync so clients can correct drift between track changes."""
+    if CLOCK_SYNC_INTERVAL <= 0:
+        return
+    while True:
+        await asyncio.sleep(CLOCK_SYNC_INTERVAL)
+        music_manager.broadcast({
+            "type": "clock",
             "track": current_track_index,
-            "time": elapsed_time,
-            "url": playlist[current_track_index]
-        }
-        await music_manager.broadcast(state)
-        await asyncio.sleep(1)
+            "time": time.time() - start_time,
+            "server_time": time.time()
+        })
 
 @app.websocket("/ws/music")
 async def music_websocket_endpoint(websocket: WebSocket):
     await music_manager.connect(websocket)
     try:
+        # The full state goes out once on connect; after that only on track changes
+        music_manager.send(websocket, music_state())
         while True:
-            await websocket.receive_text()
+            # Clients may send {"type": "ping", "client_time": ...} to measure their clock offset
+            message = await websocket.receive_text()
+            try:
+                data = json.loads(message)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(data, dict) and data.get("type") == "ping":
+                music_manager.send(websocket, {
+                    "type": "pong",
+                    "client_time": data.get("client_time"),
+                    "server_time": time.time()
+                })
     except WebSocketDisconnect:
+        pass
+    finally:
         music_manager.disconnect(websocket)
 
 @app.websocket("/ws/chat")
@@ -111,7 +355,7 @@ async def chat_websocket_endpoint(websocket: WebSocket):
             try:
                 # Receive data
                 data = await websocket.receive_json()
-                logger.info(f"Received data: {data}")
+                logger.debug("Received data: %s", data)
 
                 # Validate and filter data
                 message = data.get("message", "").strip()
@@ -121,12 +365,16 @@ async def chat_websocket_endpoint(websocket: WebSocket):
                     logger.warning("Empty message received, skipping")
                     continue
 
-                if any(word in message.lower() for word in banned_words):
-                    logger.warning(f"Message from {username} contains a banned word: {message}")
+                with STAGE_SECONDS.labels("moderation").time():
+                    banned_word = moderation.find_banned_word(message)
+                if banned_word is not None:
+                    logger.warning("Message from %s contains a banned word (%s): %s", username, banned_word, message,
+                                   extra={"fields": {"username": username, "reason": "banned_word"}})
                     continue
 
-                if re.search(banned_links_pattern, message):
-                    logger.warning(f"Message from {username} contains a link: {message}")
+                if moderation.contains_link(message):
+                    logger.warning("Message from %s contains a link: %s", username, message,
+                                   extra={"fields": {"username": username, "reason": "link"}})
                     continue
 
                 # Broadcast message to chat
@@ -135,27 +383,55 @@ async def chat_websocket_endpoint(websocket: WebSocket):
                     "username": username,
                     "message": message,
                 }
-                logger.info(f"Broadcasting chat message: {chat_message}")
-                await chat_manager.broadcast(chat_message, sender=websocket)
+                logger.debug("Broadcasting chat message: %s", chat_message)
+                chat_manager.broadcast(chat_message, sender=websocket)
+                with STAGE_SECONDS.labels("pubsub_publish").time():
+                    await pubsub.publish("chat", {"origin": WORKER_ID, "message": chat_message})
 
             except WebSocketDisconnect:
                 logger.info("WebSocket disconnected in loop.")
                 break
             except Exception as e:
-                logger.error(f"Error in WebSocket loop: {e}")
+                logger.error("Error in WebSocket loop: %s", e)
 
     except WebSocketDisconnect:
         logger.info("WebSocket disconnected.")
     finally:
         chat_manager.disconnect(websocket)
 
+def on_remote_chat(message):
+    # Messages from this worker were already sent to its own sockets
+    if message["origin"] != WORKER_ID:
+        chat_manager.broadcast(message["message"])
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/stats")
+async def stats():
+    return {"worker": WORKER_ID, "music": music_manager.stats(), "chat": chat_manager.stats()}
+
 @app.post("/update-banned-words/")
 async def update_banned_words(words: list[str]):
-    global banned_words
-    banned_words = words
-    return {"message": "Banned words updated.", "banned_words": banned_words}
+    await pubsub.set_state("banned_words", words)
+    await pubsub.publish("banned_words", {"words": words})
+    return {"message": "Banned words updated.", "banned_words": words}
+
+def on_banned_words(message):
+    asyncio.create_task(rebuild_moderation(message["words"]))
+
+async def rebuild_moderation(words):
+    """Builds the new engine in a thread and swaps it in; chat keeps using the old one until then."""
+    global moderation, moderation_version
+    moderation_version += 1
+    version = moderation_version
+    engine = await asyncio.to_thread(ModerationEngine, words, MODERATION_WORD_BOUNDARIES)
+    if version == moderation_version:  # Otherwise a newer list arrived while this one was building
+        moderation = engine
+        logger.info("Moderation engine rebuilt with %d banned words", len(engine))
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run("main:app", host="0.0.0.0", port=port)
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=port, log_config=None)  # Logging is set up by configure_logging
\ No newline at end of file
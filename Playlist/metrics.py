@@ -0,0 +1,11 @@
+from prometheus_client import Histogram
+
+# Per-stage latency, exposed on /metrics (a histogram observation costs about a microsecond).
+# Kept out of main.py: `python main.py` imports main a second time for uvicorn, and a metric
+# can only be registered once per process.
+STAGE_SECONDS = Histogram(
+    "shrokai_playlist_stage_seconds",
+    "Time spent in each stage of handling chat and music messages",
+    ["stage"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+)
@@ -0,0 +1,123 @@
+import re
+import unicodedata
+from collections import deque
+
+# Digits and symbols commonly used in place of letters ("h4t3" -> "hate")
+LEETSPEAK = str.maketrans({
+    "0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "8": "b", "9": "g",
+    "@": "a", "$": "s", "!": "i", "|": "l", "+": "t"
+})
+
+LINK_PATTERN = re.compile(r"(?:https?://|www\.)\S+", re.IGNORECASE)
+
+def fold(text, casefold=True):
+    """
+    Unifies compatibility forms (fullwidth, ligatures), drops accents and folds case.
+    Full case folding also expands some letters ("ß" -> "ss"); casefold=False only lowercases.
+    """
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(char for char in text if not unicodedata.combining(char))
+    return text.casefold() if casefold else text.lower()
+
+def normalize(text):
+    """
+    Folds text so look-alikes match: "Ｂáｄ Ｗ0rd" -> "bad word".
+    """
+    return fold(text).translate(LEETSPEAK)
+
+class ModerationEngine:
+    """
+    Matches a chat message against every banned word in a single pass.
+
+    The words are compiled once into an Aho-Corasick automaton, so the cost of a check
+    depends on the message length, not on the size of the list. An engine never changes
+    after it is built; updates build a new one and swap the reference.
+
+    With word_boundaries, a banned word only matches as a whole word ("ass" no longer
+    matches "class"), and look-alikes are matched too: full case folding and leetspeak
+    ("h4t3", "cl@ss"). Without it, any occurrence matches, like the old substring check,
+    after only lowercasing and dropping accents. Leetspeak and case-folding expansions
+    inside words would add false positives there ("straße" -> "strasse" contains "ass").
+    """
+
+    def __init__(self, words, word_boundaries=False):
+        self.words = list(words)
+        self.word_boundaries = word_boundaries
+
+        # Node i: transitions[i] maps a character to the next node, fail[i] is the longest
+        # proper suffix that is also a node, matches[i] holds the lengths of the patterns
+        # ending here (including those reached through fail links)
+        self.transitions = [{}]
+        self.fail = [0]
+        self.matches = [()]
+
+        for word in self.words:
+            pattern = (normalize(word) if word_boundaries else fold(word, casefold=False)).strip()
+            if pattern:
+                self._add(pattern)
+        self._link()
+
+    def __len__(self):
+        return len(self.words)
+
+    def _add(self, pattern):
+        node = 0
+        for char in pattern:
+            next_node = self.transitions[node].get(char)
+            if next_node is None:
+                next_node = len(self.transitions)
+                self.transitions.append({})
+                self.fail.append(0)
+                self.matches.append(())
+                self.transitions[node][char] = next_node
+            node = next_node
+        if len(pattern) not in self.matches[node]:
+            self.matches[node] += (len(pattern),)
+
+    def _link(self):
+        """Computes fail links breadth first, so every shorter suffix is done before it's needed."""
+        queue = deque(self.transitions[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.transitions[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.transitions[fallback].get(char, 0)
+                self.matches[child] += self.matches[self.fail[child]]
+
+    def find_banned_word(self, message):
+        """Returns the first banned word (normalized) found in message, or None."""
+        # Leetspeak replacement is one character for one, so positions in both strings line up;
+        # word boundaries are judged on the folded text, where "bad!" still ends in punctuation
+        if self.word_boundaries:
+            folded = fold(message)
+            text = folded.translate(LEETSPEAK)
+        else:
+            folded = text = fold(message, casefold=False)
+        transitions, fail, matches = self.transitions, self.fail, self.matches
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in transitions[node]:
+                node = fail[node]
+            node = transitions[node].get(char, 0)
+            for length in matches[node]:
+                start = index - length + 1
+                if self.word_boundaries:
+                    if not self._is_whole_word(folded, start, index + 1):
+                        continue
+                    # "!" at the end of a word closes a sentence far more often than it spells an i
+                    if folded[index] == "!":
+                        continue
+                return text[start:index + 1]
+        return None
+
+    @staticmethod
+    def _is_whole_word(text, start, end):
+        return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+    @staticmethod
+    def contains_link(message):
+        return LINK_PATTERN.search(message) is not None
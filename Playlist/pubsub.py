@@ -0,0 +1,136 @@
+import asyncio
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class InMemoryPubSub:
+    """
+    Backend for a single worker: messages, locks and shared state live in this process.
+    """
+
+    def __init__(self):
+        self.handlers = {}  # channel -> list of handler(message)
+        self.locks = {}  # name -> (owner, expires_at)
+        self.state = {}
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def subscribe(self, channel, handler):
+        """Registers handler(message) for a channel; call before start()."""
+        self.handlers.setdefault(channel, []).append(handler)
+
+    async def publish(self, channel, message):
+        for handler in self.handlers.get(channel, []):
+            try:
+                handler(message)
+            except Exception as e:
+                logger.error("Pub/sub handler for %s failed: %s", channel, e)
+
+    async def hold_lock(self, name, owner, ttl):
+        """Takes or renews a lock for ttl seconds; returns whether owner holds it."""
+        holder = self.locks.get(name)
+        if holder is None or holder[0] == owner or holder[1] < time.monotonic():
+            self.locks[name] = (owner, time.monotonic() + ttl)
+            return True
+        return False
+
+    async def get_state(self, key):
+        return self.state.get(key)
+
+    async def set_state(self, key, value):
+        self.state[key] = value
+
+class RedisPubSub:
+    """
+    Backend shared by every worker and node through a Redis-protocol server.
+
+    Uses PUBLISH/SUBSCRIBE for messages, SET NX PX plus a small EVAL script for locks and
+    plain keys for shared state, so any compatible server (Redis, Valkey, KeyDB, or a local
+    stand-in during testing) works.
+    """
+
+    # Renews the lock if owner holds it, otherwise tries to take it
+    HOLD_LOCK_SCRIPT = """
+    if redis.call("get", KEYS[1]) == ARGV[1] then
+        return redis.call("pexpire", KEYS[1], ARGV[2])
+    end
+    if redis.call("set", KEYS[1], ARGV[1], "NX", "PX", ARGV[2]) then
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(self, url, prefix="playlist"):
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(url, decode_responses=True)
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.prefix = prefix
+        self.handlers = {}
+        self.reader = None
+
+    def _key(self, name):
+        return f"{self.prefix}:{name}"
+
+    async def start(self):
+        await self.pubsub.subscribe(*self.handlers)
+        self.reader = asyncio.create_task(self._read())
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        await self.pubsub.aclose()
+        await self.redis.aclose()
+
+    def subscribe(self, channel, handler):
+        """Registers handler(message) for a channel; call before start()."""
+        self.handlers.setdefault(self._key(channel), []).append(handler)
+
+    async def _read(self):
+        while True:
+            try:
+                # The client resubscribes on its own after a reconnect
+                async for message in self.pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    for handler in self.handlers.get(message["channel"], []):
+                        try:
+                            handler(json.loads(message["data"]))
+                        except Exception as e:
+                            logger.error("Pub/sub handler for %s failed: %s", message["channel"], e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Pub/sub connection failed, retrying: %s", e)
+                await asyncio.sleep(1)
+
+    async def publish(self, channel, message):
+        await self.redis.publish(self._key(channel), json.dumps(message))
+
+    async def hold_lock(self, name, owner, ttl):
+        """Takes or renews a lock for ttl seconds; returns whether owner holds it."""
+        held = await self.redis.eval(self.HOLD_LOCK_SCRIPT, 1, self._key(name), owner, int(ttl * 1000))
+        return bool(held)
+
+    async def get_state(self, key):
+        value = await self.redis.get(self._key(key))
+        return json.loads(value) if value is not None else None
+
+    async def set_state(self, key, value):
+        await self.redis.set(self._key(key), json.dumps(value))
+
+def create_pubsub(url):
+    """
+    Picks the backend: "memory" for a single worker, or a redis:// URL to share across workers.
+    """
+    if url == "memory":
+        return InMemoryPubSub()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisPubSub(url)
+    raise ValueError(f"Unknown pub/sub backend {url!r}, expected 'memory' or a redis:// URL")
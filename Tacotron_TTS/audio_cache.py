@@ -0,0 +1,125 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Cached files are named <sha256>_<duration in ms>.ogg, so the index needs no file reads
+CACHE_FILE_PATTERN = re.compile(r"^([0-9a-f]{64})_(\d+)\.ogg$")
+
+def make_cache_key(text, *settings):
+    """
+    Hashes the normalized text together with everything else that shapes the audio
+    (model name, pitch factor, encoder arguments).
+    """
+    normalized = " ".join(text.split()).lower()
+    digest = hashlib.sha256()
+    for part in (normalized, *settings):
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class AudioCache:
+    """
+    Content-addressed disk cache of finished OGG files and their durations.
+
+    The in-memory index is rebuilt at startup from a directory listing, ordered by
+    modification time. Reads touch the file, so the order survives restarts, and the
+    least recently used files are deleted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.index = OrderedDict()  # key -> (path, size, duration)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        entries = []
+        with os.scandir(self.directory) as listing:
+            for entry in listing:
+                if entry.name.endswith(".tmp"):
+                    # Left over from a write that was interrupted
+                    self._delete(entry.path)
+                    continue
+                match = CACHE_FILE_PATTERN.match(entry.name)
+                if not match or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, match.group(1), entry.path, stat.st_size, int(match.group(2)) / 1000))
+
+        for _, key, path, size, duration in sorted(entries):
+            self.index[key] = (path, size, duration)
+            self.size += size
+
+        logger.info("Audio cache loaded: %d files, %d bytes", len(self.index), self.size)
+        with self.lock:
+            self._evict()
+
+    def get(self, key):
+        """
+        Returns (ogg_data, duration) for a cached key, or None.
+        """
+        with self.lock:
+            item = self.index.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self.index.move_to_end(key)
+
+        path, _, duration = item
+        try:
+            with open(path, "rb") as cached_file:
+                data = cached_file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                if self.index.pop(key, None) is not None:
+                    self.size -= item[1]
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return data, duration
+
+    def put(self, key, data, duration):
+        path = os.path.join(self.directory, f"{key}_{round(duration * 1000)}.ogg")
+
+        # Write to a temporary file first so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+
+        with self.lock:
+            previous = self.index.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+                if previous[0] != path:
+                    self._delete(previous[0])
+            self.index[key] = (path, len(data), duration)
+            self.size += len(data)
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self.index) > 1:
+            _, (path, size, _) = self.index.popitem(last=False)
+            self.size -= size
+            self._delete(path)
+
+    def _delete(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -1,28 +1,94 @@
-from flask import Flask, request, jsonify
-from TTS.api import TTS
-from pydub import AudioSegment
+from flask import Flask, Response, request, jsonify, stream_with_context
+from werkzeug.serving import WSGIRequestHandler
+from sftp_pool import SFTPPool
+from synthesis_pool import SynthesisPool
+from audio_cache import AudioCache, make_cache_key
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+import numpy as np
+import base64
+import json
 import os
 import uuid
-import paramiko  # For file transfer via SCP
 import logging
 import subprocess
+import sys
+import threading
 
-# Logging setup
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s [%(levelname)s]: %(message)s')
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.structured_logging import configure_logging
+
+# Logging setup (LOG_LEVEL, LOG_FORMAT; see common/structured_logging.py)
+configure_logging("tacotron_tts")
 logger = logging.getLogger()
 
 app = Flask(__name__, static_folder="static")
 
-# Initialize TTS model
+# TTS model, loaded in every synthesis worker process
 MODEL_NAME = "tts_models/en/ljspeech/tacotron2-DDC"
-tts = TTS(MODEL_NAME, progress_bar=False)
-logger.info("TTS model initialized: %s", MODEL_NAME)
+TTS_WORKERS = int(os.environ.get("TTS_WORKERS", os.cpu_count() or 1))  # Synthesis processes
+
+synthesis_pool = None
+synthesis_pool_lock = threading.Lock()
+
+def get_synthesis_pool():
+    """
+    Starts the synthesis pool on first use. Workers are spawned processes that
+    re-import this module, so the pool must not be created at import time.
+    """
+    global synthesis_pool
+    with synthesis_pool_lock:
+        if synthesis_pool is None:
+            synthesis_pool = SynthesisPool(MODEL_NAME, workers=TTS_WORKERS)
+            logger.info("TTS model initialized: %s", MODEL_NAME)
+    return synthesis_pool
 
 # VPS settings
-VPS_HOST = ""  # Your VPS IP address
-VPS_USERNAME = ""  # Username
-VPS_PASSWORD = ""  # Password
+VPS_HOST = os.environ.get("VPS_HOST", "")  # Your VPS IP address
+VPS_USERNAME = os.environ.get("VPS_USERNAME", "")  # Username
+VPS_PASSWORD = os.environ.get("VPS_PASSWORD", "")  # Password
 VPS_DEST_PATH = "/tmp/tts_files"  # Path for storing files on VPS
+VPS_PORT = int(os.environ.get("VPS_PORT", 22))
+SFTP_MAX_SESSIONS = int(os.environ.get("SFTP_MAX_SESSIONS", 4))  # Concurrent uploads / open sessions
+
+# Sessions are opened on first upload and kept alive between requests
+sftp_pool = SFTPPool(VPS_HOST, VPS_USERNAME, VPS_PASSWORD, port=VPS_PORT, max_sessions=SFTP_MAX_SESSIONS)
+
+# Audio settings
+PITCH_FACTOR = 0.6  # Playback rate factor used to make the voice deeper
+OGG_ARGS = ["-ar", "44100", "-ac", "2", "-b:a", "128k"]  # Encoder output settings
+# Streaming encoder settings: Opus pages are flushed every 200 ms instead of once per second
+OPUS_ARGS = ["-c:a", "libopus", "-ar", "48000", "-ac", "2", "-b:a", "64k", "-page_duration", "200000", "-flush_packets", "1"]
+SECONDS_PER_CHARACTER = 0.065  # Average speaking rate of the model before the pitch change
+
+# Synthesized audio cache (repeated lines skip synthesis, encoding and, if possible, the upload)
+AUDIO_CACHE = os.environ.get("AUDIO_CACHE", "1") == "1"
+AUDIO_CACHE_DIR = os.environ.get("AUDIO_CACHE_DIR", "audio_cache")
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get("AUDIO_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+audio_cache = None
+audio_cache_lock = threading.Lock()
+
+def get_audio_cache():
+    """
+    Opens the cache on first use. Opening it cleans up temp files and evicts, so it must
+    not happen at import time: the spawned synthesis workers re-import this module and
+    would delete the temp files of uploads in progress.
+    """
+    global audio_cache
+    if not AUDIO_CACHE:
+        return None
+    with audio_cache_lock:
+        if audio_cache is None:
+            audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES)
+    return audio_cache
+
+# Per-stage latency, exposed on /metrics (a histogram observation costs about a microsecond)
+STAGE_SECONDS = Histogram(
+    "shrokai_tts_stage_seconds",
+    "Time spent in each stage of producing audio",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
 
 STATIC_DIR = "static"
 os.makedirs(STATIC_DIR, exist_ok=True)
@@ -46,134 +112,262 @@ check_ffmpeg()  # Verify ffmpeg availability before processing audio
 def home():
     return jsonify({"message": "SHROKAI TTS is running!"})
 
-def get_audio_length(file_path):
+def get_audio_length(pcm, frame_rate):
     """
-    Determines the length of an audio file (in seconds).
+    Determines the length of 16-bit mono PCM audio (in seconds) from its sample count.
     """
-    try:
-        audio = AudioSegment.from_file(file_path)
-        duration = len(audio) / 1000  # Convert milliseconds to seconds
-        return round(duration, 2)  # Round to 2 decimal places
-    except Exception as e:
-        logger.error("Error getting audio length: %s", str(e))
-        return 0
+    duration = len(pcm) / 2 / frame_rate
+    return round(duration, 2)  # Round to 2 decimal places
+
+def estimate_audio_length(text):
+    """
+    Estimates the audio length (in seconds) from the text length, for clients that
+    need a duration before synthesis has finished.
+    """
+    return round(len(text) * SECONDS_PER_CHARACTER / PITCH_FACTOR, 2)
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
 
 @app.route("/generate", methods=["POST"])
+@STAGE_SECONDS.labels("request").time()
 def generate_audio():
+    request_id = None
     try:
-        logger.info("Received request to generate audio.")
-
-        # Get text from the request
+        # Get text from the request; the request id comes from the proxy, through the AI server
         data = request.get_json()
         text = data.get("text", "")
-        logger.debug("Text received: %s", text)
+        request_id = data.get("request_id") or uuid.uuid4().hex
+        logger.info("[%s] Received request to generate audio.", request_id)
+        logger.debug("[%s] Text received: %s", request_id, text)
 
         if not text:
-            logger.error("No text provided in the request.")
+            logger.error("[%s] No text provided in the request.", request_id)
             return jsonify({"error": "Text is required"}), 400
 
-        # Generate a file name
-        output_filename = f"{uuid.uuid4().hex}.wav"
-        output_path = os.path.join(STATIC_DIR, output_filename)
-        logger.debug("Generated output file path: %s", output_path)
-
-        # Generate audio
-        tts.tts_to_file(text=text, file_path=output_path)
-        logger.info("Audio file generated: %s", output_path)
-
-        # Adjust pitch
-        processed_filename = f"processed_{uuid.uuid4().hex}.wav"
-        processed_path = os.path.join(STATIC_DIR, processed_filename)
-        lower_pitch(output_path, processed_path)
-        logger.info("Processed audio file created: %s", processed_path)
-
-        # Convert to OGG
-        ogg_filename = f"{uuid.uuid4().hex}.ogg"
-        ogg_path = os.path.join(STATIC_DIR, ogg_filename)
-        convert_to_ogg(processed_path, ogg_path)
-        logger.info("Converted to OGG: %s", ogg_path)
-
-        # Check if file exists
-        if not os.path.exists(ogg_path):
-            logger.error("OGG file not found.")
-            return jsonify({"error": "OGG file not found."}), 500
-
-        # Determine audio file length
-        audio_length = get_audio_length(ogg_path)
-        logger.info("Audio length calculated: %s seconds", audio_length)
-
-        # Send file to VPS
-        logger.info("Attempting to send file to VPS: %s", VPS_HOST)
-        send_file_to_vps(ogg_path)
-
-        # Delete temporary files
-        os.remove(output_path)
-        os.remove(processed_path)
-        os.remove(ogg_path)
-        logger.info("Temporary files deleted.")
+        # Files are named after the content hash, so identical lines map to the same file
+        cache_key = make_cache_key(text, MODEL_NAME, PITCH_FACTOR, *OGG_ARGS)
+        ogg_filename = f"{cache_key}.ogg"
+
+        cache = get_audio_cache()
+        with STAGE_SECONDS.labels("cache_lookup").time():
+            cached = cache.get(cache_key) if cache is not None else None
+        if cached is not None:
+            ogg_data, audio_length = cached
+            logger.info("[%s] Audio cache hit: %s (%s seconds)", request_id, cache_key, audio_length)
+        else:
+            # Generate audio
+            samples, sample_rate = synthesize(text)
+            logger.info("[%s] Audio generated: %d samples at %d Hz", request_id, len(samples), sample_rate)
+
+            # Adjust pitch
+            pcm, frame_rate = lower_pitch(samples, sample_rate)
+            logger.info("Pitch adjusted: playback at %d Hz", frame_rate)
+
+            # Convert to OGG
+            ogg_data = convert_to_ogg(pcm, frame_rate)
+            logger.info("Converted to OGG: %d bytes", len(ogg_data))
+
+            if not ogg_data:
+                logger.error("[%s] OGG encoder produced no data.", request_id)
+                return jsonify({"error": "OGG encoding failed."}), 500
+
+            # Determine audio length
+            audio_length = get_audio_length(pcm, frame_rate)
+            logger.info("[%s] Audio length calculated: %s seconds", request_id, audio_length)
+
+            if cache is not None:
+                cache.put(cache_key, ogg_data, audio_length)
+
+        # Send file to VPS, unless it still holds this exact audio
+        if cached is not None and sftp_pool.exists(os.path.join(VPS_DEST_PATH, ogg_filename)):
+            logger.info("[%s] VPS already has %s, skipping upload.", request_id, ogg_filename)
+        else:
+            logger.info("[%s] Attempting to send file to VPS: %s", request_id, VPS_HOST)
+            send_file_to_vps(ogg_data, ogg_filename)
 
         # Return audio file length in the response
         return jsonify({
             "status": "success",
             "message": "File sent to VPS successfully.",
-            "audio_length": audio_length
+            "audio_length": audio_length,
+            "request_id": request_id
         })
 
     except Exception as e:
-        logger.error("Error during audio generation: %s", str(e))
+        logger.error("[%s] Error during audio generation: %s", request_id, str(e))
         return jsonify({"error": str(e)}), 500
 
-def lower_pitch(input_path, output_path):
+@app.route("/generate-stream", methods=["POST"])
+def generate_audio_stream():
+    """
+    Streams Ogg/Opus audio while synthesis continues, as newline-delimited JSON frames:
+    {"type": "start", "audio_length_estimate": ...} first, then {"type": "audio", "data": <base64>}
+    for every chunk of Ogg pages the encoder produces, and {"type": "end", "audio_length": ...}
+    with the exact length once the file has also been sent to the VPS.
+    """
+    data = request.get_json()
+    text = data.get("text", "") if data else ""
+    request_id = (data.get("request_id") if data else None) or uuid.uuid4().hex
+    logger.info("[%s] Received request to stream audio.", request_id)
+    logger.debug("[%s] Text received: %s", request_id, text)
+
+    if not text:
+        logger.error("No text provided in the request.")
+        return jsonify({"error": "Text is required"}), 400
+
+    # All sentences start synthesizing now; they are encoded in order as they finish
+    futures = get_synthesis_pool().submit(text)
+    return Response(stream_with_context(stream_audio(text, futures, request_id)), mimetype="application/x-ndjson")
+
+def stream_frame(data):
+    return json.dumps(data) + "\n"
+
+def stream_audio(text, futures, request_id=None):
+    """
+    Feeds synthesized sentences into a live Opus encoder and yields its output as frames.
+    """
+    pool = get_synthesis_pool()
+    encoder = None
+    state = {"pcm_bytes": 0, "error": None}
+
+    yield stream_frame({"type": "start", "audio_length_estimate": estimate_audio_length(text)})
+
+    try:
+        try:
+            first_samples, sample_rate = pool.collect(futures[0])
+        except Exception:
+            pool.discard(futures[1:])
+            raise
+        frame_rate = int(sample_rate * PITCH_FACTOR)
+        encoder = start_stream_encoder(frame_rate)
+
+        def feed_encoder():
+            # The full waveform isn't known up front, so normalize to the loudest peak seen so far
+            peak = 0.01
+            remaining = list(futures[1:])
+            try:
+                samples = first_samples
+                while True:
+                    if len(samples):
+                        peak = max(peak, float(np.max(np.abs(samples))))
+                    pcm = (np.clip(samples / peak, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+                    encoder.stdin.write(pcm)
+                    state["pcm_bytes"] += len(pcm)
+                    if not remaining:
+                        break
+                    samples, _ = pool.collect(remaining.pop(0))
+            except Exception as e:
+                state["error"] = e
+                pool.discard(remaining)
+            finally:
+                try:
+                    encoder.stdin.close()
+                except OSError:
+                    pass
+
+        feeder = threading.Thread(target=feed_encoder, daemon=True)
+        feeder.start()
+
+        ogg_data = bytearray()
+        while chunk := encoder.stdout.read1(65536):
+            ogg_data += chunk
+            yield stream_frame({"type": "audio", "data": base64.b64encode(chunk).decode()})
+
+        feeder.join()
+        encoder.wait()
+        if state["error"] is not None:
+            raise state["error"]
+        if encoder.returncode != 0:
+            raise RuntimeError(f"ffmpeg exited with {encoder.returncode}: {encoder.stderr.read().decode(errors='replace')}")
+
+        audio_length = round(state["pcm_bytes"] / 2 / frame_rate, 2)
+        logger.info("[%s] Streamed %d bytes of audio (%s seconds).", request_id, len(ogg_data), audio_length)
+
+        # Keep the VPS copy so playback works the same as with /generate
+        send_file_to_vps(bytes(ogg_data), f"{uuid.uuid4().hex}.ogg")
+
+        yield stream_frame({"type": "end", "status": "success", "audio_length": audio_length})
+
+    except Exception as e:
+        logger.error("[%s] Error during audio streaming: %s", request_id, str(e))
+        yield stream_frame({"type": "error", "error": str(e)})
+    finally:
+        if encoder is not None and encoder.poll() is None:
+            encoder.kill()
+
+def start_stream_encoder(frame_rate):
+    """
+    Starts an ffmpeg process that turns mono 16-bit PCM on stdin into Ogg/Opus on stdout.
+    """
+    return subprocess.Popen(
+        ["ffmpeg", "-loglevel", "error", "-f", "s16le", "-ar", str(frame_rate), "-ac", "1", "-i", "pipe:0",
+         "-vn", *OPUS_ARGS, "-f", "ogg", "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+
+@STAGE_SECONDS.labels("synthesis").time()
+def synthesize(text):
+    """
+    Synthesizes text on the worker pool (sentences in parallel) and returns
+    the float waveform and its sample rate.
+    """
+    return get_synthesis_pool().synthesize(text)
+
+@STAGE_SECONDS.labels("lower_pitch").time()
+def lower_pitch(samples, sample_rate):
     """
     Lowers the pitch of the audio with a fixed pitch_factor = 0.6.
+    The samples are peak-normalized to 16-bit PCM (as tts_to_file did) and labelled with a
+    lower frame rate, so they play slower and deeper; ffmpeg resamples to 44.1 kHz once.
     """
     try:
         logger.info("Lowering pitch of the audio.")
-        pitch_factor = 0.6
-        audio = AudioSegment.from_file(input_path)
-        audio = audio._spawn(audio.raw_data, overrides={
-            "frame_rate": int(audio.frame_rate * pitch_factor)
-        }).set_frame_rate(audio.frame_rate)
-        audio.export(output_path, format="wav")
-        logger.info("Pitch adjustment complete: %s", output_path)
+        peak = max(0.01, float(np.max(np.abs(samples)))) if len(samples) else 1.0
+        pcm = (samples * (32767 / peak)).astype("<i2").tobytes()
+        return pcm, int(sample_rate * PITCH_FACTOR)
     except Exception as e:
         logger.error("Error lowering pitch: %s", str(e))
         raise
 
-def convert_to_ogg(input_path, output_path):
+@STAGE_SECONDS.labels("ffmpeg").time()
+def convert_to_ogg(pcm, frame_rate):
     """
-    Converts a WAV file to OGG.
+    Encodes raw mono 16-bit PCM to OGG, piping it through a single ffmpeg process.
     """
     try:
         logger.info("Converting to OGG.")
-        subprocess.run(["ffmpeg", "-i", input_path, "-vn", "-ar", "44100", "-ac", "2", "-b:a", "128k", output_path], check=True)
-        logger.info("Conversion complete: %s", output_path)
+        result = subprocess.run(
+            ["ffmpeg", "-loglevel", "error", "-f", "s16le", "-ar", str(frame_rate), "-ac", "1", "-i", "pipe:0",
+             "-vn", *OGG_ARGS, "-f", "ogg", "pipe:1"],
+            input=pcm, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+        )
+        logger.info("Conversion complete.")
+        return result.stdout
+    except subprocess.CalledProcessError as e:
+        logger.error("Error converting to OGG: %s", e.stderr.decode(errors="replace"))
+        raise
     except Exception as e:
         logger.error("Error converting to OGG: %s", str(e))
         raise
 
-def send_file_to_vps(file_path):
+@STAGE_SECONDS.labels("sftp_upload").time()
+def send_file_to_vps(data, filename):
     """
-    Sends a file to a VPS via SCP.
+    Uploads in-memory file data (or a local path) to a VPS over a pooled SFTP session.
     """
     try:
-        logger.info("Connecting to VPS at %s", VPS_HOST)
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(VPS_HOST, username=VPS_USERNAME, password=VPS_PASSWORD)
-        logger.info("Connected to VPS successfully.")
-
-        # Transfer file
-        sftp = ssh.open_sftp()
-        dest_path = os.path.join(VPS_DEST_PATH, os.path.basename(file_path))
-        sftp.put(file_path, dest_path)
-        sftp.close()
-        ssh.close()
-        logger.info("File successfully sent to VPS: %s", file_path)
+        dest_path = os.path.join(VPS_DEST_PATH, filename)
+        sftp_pool.upload(data, dest_path)
+        logger.info("File successfully sent to VPS: %s", dest_path)
 
     except Exception as e:
         logger.error("Error sending file to VPS: %s", str(e))
         raise
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+    get_synthesis_pool().warmup()  # Load the model in every worker before taking requests
+    get_audio_cache()  # Clean up and index the cache directory before taking requests
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"  # Lets /generate-stream use chunked transfer encoding
+    app.run(host="0.0.0.0", port=5000, threaded=True)
\ No newline at end of file
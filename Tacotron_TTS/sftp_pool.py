@@ -0,0 +1,170 @@
+import io
+import logging
+import queue
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the session is unusable and the upload may be retried on a new one.
+# A dead channel can also surface as a plain OSError ("Socket is closed").
+CONNECTION_ERRORS = (paramiko.SSHException, EOFError, ConnectionError, socket.timeout, OSError)
+
+# SFTP status replies that a new session won't change; they prove the channel still works
+PERMANENT_ERRORS = (FileNotFoundError, PermissionError)
+
+
+class SFTPSession:
+    """
+    One SSH connection with an open SFTP channel.
+    """
+
+    def __init__(self, ssh, sftp):
+        self.ssh = ssh
+        self.sftp = sftp
+
+    def is_healthy(self):
+        """The transport can outlive the SFTP channel, so both have to be open."""
+        transport = self.ssh.get_transport()
+        return transport is not None and transport.is_active() and not self.sftp.sock.closed
+
+    def close(self):
+        try:
+            self.sftp.close()
+            self.ssh.close()
+        except Exception as e:
+            logger.debug("Error closing SFTP session: %s", e)
+
+class SFTPPool:
+    """
+    Long-lived SSH/SFTP sessions to the VPS, shared by request threads.
+
+    Sessions are opened lazily, reused after each upload and checked before reuse;
+    dead ones are replaced. Connecting retries with jittered exponential backoff, and
+    at most max_sessions channels are in use at once. Point host/port at a local
+    paramiko server to test it.
+    """
+
+    def __init__(self, host, username, password, port=22, max_sessions=4, connect_timeout=10,
+                 max_retries=3, backoff=0.5, keepalive=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.keepalive = keepalive
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(max_sessions)
+
+    def _connect(self):
+        for attempt in range(self.max_retries + 1):
+            ssh = paramiko.SSHClient()
+            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            try:
+                ssh.connect(
+                    self.host,
+                    port=self.port,
+                    username=self.username,
+                    password=self.password,
+                    timeout=self.connect_timeout,
+                    banner_timeout=self.connect_timeout,
+                    auth_timeout=self.connect_timeout
+                )
+                # Keepalives stop idle sessions from being dropped by NAT or the server
+                ssh.get_transport().set_keepalive(self.keepalive)
+                logger.info("Connected to VPS at %s:%s", self.host, self.port)
+                return SFTPSession(ssh, ssh.open_sftp())
+            except CONNECTION_ERRORS as e:
+                ssh.close()
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.warning("Connection to VPS failed (%s), retrying in %.2fs", e, delay)
+                time.sleep(delay)
+
+    def _checkout(self):
+        while True:
+            try:
+                session = self.idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if session.is_healthy():
+                return session
+            logger.info("Dropping dead SFTP session.")
+            session.close()
+
+    @contextmanager
+    def session(self):
+        """
+        Borrows an SFTP client; the session returns to the pool unless it failed with a
+        connection error or died.
+        """
+        with self.slots:
+            session = self._checkout()
+            try:
+                yield session.sftp
+            except PERMANENT_ERRORS:
+                self._release(session)
+                raise
+            except CONNECTION_ERRORS:
+                session.close()
+                raise
+            except BaseException:
+                self._release(session)
+                raise
+            self._release(session)
+
+    def _release(self, session):
+        if session.is_healthy():
+            self.idle.put(session)
+        else:
+            session.close()
+
+    def upload(self, source, remote_path):
+        """
+        Uploads a local path, bytes or a readable file object to remote_path.
+        A session that breaks mid-upload is replaced and the upload retried once.
+        """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+
+        for attempt in range(2):
+            try:
+                with self.session() as sftp:
+                    if hasattr(source, "read"):
+                        source.seek(0)
+                        sftp.putfo(source, remote_path)
+                    else:
+                        sftp.put(source, remote_path)
+                return
+            except PERMANENT_ERRORS:
+                raise
+            except CONNECTION_ERRORS as e:
+                if attempt == 1:
+                    raise
+                logger.warning("Upload to VPS failed (%s), retrying on a new session", e)
+
+    def exists(self, remote_path):
+        """
+        Checks whether remote_path exists on the VPS.
+        """
+        with self.session() as sftp:
+            try:
+                sftp.stat(remote_path)
+                return True
+            except FileNotFoundError:
+                return False
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,127 @@
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Model instance of the current worker process
+worker_tts = None
+
+def split_sentences(text):
+    """
+    Splits text at sentence boundaries; text without any is returned as one piece.
+    """
+    sentences = [sentence.strip() for sentence in re.split(r"(?<=[.!?])\s+", text)]
+    return [sentence for sentence in sentences if sentence] or [text]
+
+def init_worker(model_name, torch_threads):
+    """
+    Loads the TTS model once per worker process.
+    """
+    global worker_tts
+    import torch
+    from TTS.api import TTS
+
+    torch.set_num_threads(torch_threads)
+    worker_tts = TTS(model_name, progress_bar=False)
+
+def synthesize_to_shared_memory(text):
+    """
+    Runs in a worker: synthesizes text and leaves the float32 samples in a new
+    shared memory block, so only its name crosses the process boundary.
+    """
+    samples = np.asarray(worker_tts.tts(text=text), dtype=np.float32)
+    block = shared_memory.SharedMemory(create=True, size=max(samples.nbytes, 1))
+    np.ndarray(samples.shape, dtype=np.float32, buffer=block.buf)[:] = samples
+    name = block.name
+    block.close()
+    return name, len(samples), worker_tts.synthesizer.output_sample_rate
+
+def read_shared_memory(name, length):
+    """
+    Copies samples out of a worker's shared memory block and frees the block.
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray((length,), dtype=np.float32, buffer=block.buf).copy()
+    finally:
+        block.close()
+        block.unlink()
+
+class SynthesisPool:
+    """
+    Preloads the TTS model in N worker processes and spreads requests across them.
+    Texts are split into sentences that are synthesized in parallel and joined in order.
+    """
+
+    def __init__(self, model_name, workers=None):
+        cpu_count = os.cpu_count() or 1
+        self.workers = workers or cpu_count
+        # Give each worker its share of cores so torch threads don't oversubscribe the box
+        torch_threads = max(1, cpu_count // self.workers)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(model_name, torch_threads)
+        )
+        logger.info("Synthesis pool started: %d workers, %d torch threads each", self.workers, torch_threads)
+
+    def warmup(self):
+        """
+        Starts every worker and loads its model before the first request arrives.
+        """
+        futures = [self.executor.submit(synthesize_to_shared_memory, "Hello.") for _ in range(self.workers)]
+        for future in futures:
+            name, length, _ = future.result()
+            read_shared_memory(name, length)
+        logger.info("Synthesis pool warmed up.")
+
+    def submit(self, text):
+        """
+        Starts synthesizing every sentence of text; returns the futures in sentence order.
+        """
+        return [self.executor.submit(synthesize_to_shared_memory, sentence) for sentence in split_sentences(text)]
+
+    def collect(self, future):
+        """
+        Waits for one sentence and returns its samples and sample rate.
+        """
+        name, length, sample_rate = future.result()
+        return read_shared_memory(name, length), sample_rate
+
+    def discard(self, futures):
+        """
+        Waits for futures whose audio is no longer needed and frees their shared memory.
+        """
+        for future in futures:
+            try:
+                self.collect(future)
+            except Exception:
+                pass
+
+    def synthesize(self, text):
+        """
+        Returns the waveform of the whole text and its sample rate.
+        """
+        parts = []
+        errors = []
+        sample_rate = None
+        # Collect every future, even after a failure, so no shared memory block is left behind
+        for future in self.submit(text):
+            try:
+                samples, sample_rate = self.collect(future)
+                parts.append(samples)
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+        return np.concatenate(parts), sample_rate
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
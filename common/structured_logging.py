@@ -0,0 +1,197 @@
+"""
+Logging setup shared by the ShrokAI services.
+
+Log calls only build a record and put it on a queue; a background thread formats the
+records (JSON by default) and writes them, so a slow stdout never blocks the event loop.
+Messages use %-style arguments and structured fields go in extra={"fields": {...}}; both
+are turned into text on the writer thread, and only for records that pass the level.
+
+Records below LOG_RATE_LIMIT_LEVEL from the same call site are rate limited (token
+bucket); warnings and errors always get through by default. A record can carry
+extra={"sample_rate": 0.01} to log only that share of its events. When records were
+suppressed, the next one that gets through reports how many in a "suppressed" field.
+
+Settings: LOG_LEVEL (INFO), LOG_FORMAT (json or text), LOG_QUEUE_SIZE (records waiting
+for the writer; beyond it records are dropped), LOG_RATE_LIMIT (records per second per
+call site, 0 disables), LOG_RATE_BURST and LOG_RATE_LIMIT_LEVEL (WARNING).
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+LOG_RATE_LIMIT = float(os.environ.get("LOG_RATE_LIMIT", 20))
+LOG_RATE_BURST = int(os.environ.get("LOG_RATE_BURST", 100))
+LOG_RATE_LIMIT_LEVEL = os.environ.get("LOG_RATE_LIMIT_LEVEL", "WARNING").upper()  # This level and above are never limited
+
+# Loggers that come with their own handlers (uvicorn's are set up by its log config);
+# they are routed through the background writer like everything else
+ROUTED_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+# Rate limit state is dropped when a logger emits this many distinct message templates
+MAX_RATE_LIMIT_KEYS = 10000
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, service, logger, message, then the fields."""
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class TextFormatter(logging.Formatter):
+    """The usual one-line format, with the fields appended as key=value."""
+
+    def __init__(self, service):
+        super().__init__(f"%(asctime)s [%(levelname)s] {service} %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = dict(getattr(record, "fields", None) or {})
+        if getattr(record, "suppressed", 0):
+            fields["suppressed"] = record.suppressed
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per call site, identified by logger name and message template, for
+    records below exempt_level, plus per-record sampling. Runs in whichever thread logs,
+    so it has to be cheap and thread-safe.
+    """
+
+    def __init__(self, rate, burst, exempt_level=logging.WARNING):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.exempt_level = exempt_level
+        self.buckets = {}  # (logger, template) -> [tokens, last refill, suppressed since last record]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        sample_rate = getattr(record, "sample_rate", None)
+        if sample_rate is not None and random.random() >= sample_rate:
+            return False
+        if self.rate <= 0 or record.levelno >= self.exempt_level:
+            return True
+
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg))
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= MAX_RATE_LIMIT_KEYS:
+                    self.buckets.clear()
+                bucket = self.buckets[key] = [self.burst, now, 0]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                bucket[2] += 1
+                return False
+            bucket[0] = tokens - 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on a bounded queue as they are, without formatting them first (the
+    standard QueueHandler formats in the caller's thread). Records that don't fit are
+    dropped and counted rather than blocking the caller.
+    """
+
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Arguments are formatted later by the writer, so log values, not objects that keep changing
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+listener = None
+
+def parse_level(level):
+    """A level number or name ("WARNING", "30"); raises ValueError for anything else."""
+    if isinstance(level, int):
+        return level
+    if level.isdigit():
+        return int(level)
+    number = logging.getLevelName(level.upper())
+    if not isinstance(number, int):  # getLevelName returns "Level X" for unknown names
+        raise ValueError(f"Unknown log level {level!r}, expected DEBUG, INFO, WARNING, ERROR or CRITICAL")
+    return number
+
+def configure_logging(service, level=LOG_LEVEL, log_format=LOG_FORMAT, stream=None,
+                      rate_limit=LOG_RATE_LIMIT, rate_burst=LOG_RATE_BURST, rate_limit_level=LOG_RATE_LIMIT_LEVEL):
+    """
+    Routes the root logger, and the ROUTED_LOGGERS, through the background writer. Safe
+    to call more than once; later calls replace the earlier setup. A server that sets up
+    its own logging afterwards has to be told not to (uvicorn.run(..., log_config=None)).
+    """
+    global listener
+    # Checked before anything changes, so a bad setting fails at startup instead of in every log call
+    exempt_level = parse_level(rate_limit_level)
+    if listener is not None:
+        listener.stop()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JSONFormatter(service) if log_format == "json" else TextFormatter(service))
+
+    handler = BackgroundQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    handler.addFilter(RateLimitFilter(rate_limit, rate_burst, exempt_level))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name in ROUTED_LOGGERS:
+        routed = logging.getLogger(name)
+        for existing in list(routed.handlers):
+            routed.removeHandler(existing)
+        routed.propagate = True
+
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    listener.start()
+    return handler
+
+def stop_logging():
+    """Writes out whatever is still queued."""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+atexit.register(stop_logging)
@@ -0,0 +1,11 @@
+"""
+Text helpers shared by the services.
+"""
+import re
+
+# Function to turn a chat message into a dedup and cache key: "@ShrokAI  GM!!" -> "gm".
+# The proxy's admission queue and the AI server's response cache must agree on it.
+def normalize_message(text):
+    text = re.sub(r"@\w+", " ", text.lower())
+    text = re.sub(r"[^\w\s]", "", text)
+    return " ".join(text.split())
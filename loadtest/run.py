@@ -0,0 +1,379 @@
+"""
+Simulates many WebSocket clients against the ShrokAI services and saves a JSON report.
+
+    python run.py music --url ws://localhost:8000/ws/music --clients 5000 --pid 1234
+    python run.py chat --url ws://localhost:8000/ws/chat --clients 2000 --senders 20
+    python run.py proxy --url ws://localhost:9000/ws/proxy --clients 2000 --senders 10
+    python run.py compare results/before.json results/after.json
+
+Pass --pid for every server process whose CPU and memory should be sampled (Linux /proc).
+For the proxy, run Chat_Proxe against `stubs.py ai`: its answers echo the request with a
+timestamp, which is what makes end-to-end latency measurable.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import time
+
+import httpx
+import websockets
+
+TIMESTAMP = re.compile(r"\bt=(\d+\.\d+)")
+REPLY_TIMESTAMP = re.compile(r"\breply=(\d+\.\d+)")
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+def summarize(values):
+    """Latency summary in milliseconds."""
+    if not values:
+        return {"samples": 0}
+    values = [value * 1000 for value in values]
+    return {
+        "samples": len(values),
+        "p50": round(percentile(values, 50), 2),
+        "p90": round(percentile(values, 90), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values), 2)
+    }
+
+def raise_file_limit():
+    """Every client needs a file descriptor; lift the soft limit as far as allowed."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+class ProcessSampler:
+    """Samples CPU time and resident memory of processes from /proc once a second."""
+
+    def __init__(self, pids):
+        self.pids = {"loadgen": os.getpid(), **{str(pid): pid for pid in pids}}
+        self.ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = resource.getpagesize()
+        self.start = {}
+        self.peak_rss = {name: 0 for name in self.pids}
+        self.task = None
+
+    def _cpu_seconds(self, pid):
+        with open(f"/proc/{pid}/stat") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self.ticks  # utime + stime
+
+    def _rss_mb(self, pid):
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * self.page_size / 2**20
+
+    def _sample(self):
+        for name, pid in self.pids.items():
+            try:
+                self.peak_rss[name] = max(self.peak_rss[name], self._rss_mb(pid))
+            except OSError:
+                pass
+
+    async def _run(self):
+        while True:
+            self._sample()
+            await asyncio.sleep(1)
+
+    def begin(self):
+        self.started_at = time.perf_counter()
+        for name, pid in self.pids.items():
+            try:
+                self.start[name] = self._cpu_seconds(pid)
+            except OSError:
+                print(f"Can't read /proc/{pid}, skipping it")
+        self.task = asyncio.create_task(self._run())
+
+    def end(self):
+        self.task.cancel()
+        self._sample()
+        elapsed = time.perf_counter() - self.started_at
+        report = {}
+        for name, pid in self.pids.items():
+            if name not in self.start:
+                continue
+            try:
+                cpu = self._cpu_seconds(pid) - self.start[name]
+            except OSError:
+                continue
+            report[name] = {
+                "cpu_seconds": round(cpu, 2),
+                "cpu_percent": round(cpu / elapsed * 100, 1),
+                "peak_rss_mb": round(self.peak_rss[name], 1)
+            }
+        return report
+
+class LoadTest:
+    """
+    Opens the clients (with a cap on concurrent handshakes), keeps them connected for
+    the test duration and collects what they observe.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.connect_times = []
+        self.connect_failures = 0
+        self.dropped = 0
+        self.open = 0
+        self.peak_open = 0
+        self.sent = 0
+        self.received = 0
+        self.latencies = {}  # name -> list of seconds
+        self.handshakes = asyncio.Semaphore(args.ramp_concurrency)
+        self.measuring = False
+
+    def record(self, name, seconds):
+        if self.measuring:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    async def client(self, index, scenario):
+        async with self.handshakes:
+            start = time.perf_counter()
+            try:
+                websocket = await websockets.connect(self.args.url, open_timeout=self.args.connect_timeout,
+                                                     ping_interval=None, max_size=None)
+            except Exception:
+                self.connect_failures += 1
+                return
+            self.connect_times.append(time.perf_counter() - start)
+
+        self.open += 1
+        self.peak_open = max(self.peak_open, self.open)
+        try:
+            await scenario(self, index, websocket, start)
+        except websockets.ConnectionClosed:
+            self.dropped += 1
+        finally:
+            self.open -= 1
+            await websocket.close()
+
+    async def receive(self, websocket):
+        message = await websocket.recv()
+        if self.measuring:
+            self.received += 1
+        return message
+
+    async def run(self, scenario):
+        clients = [asyncio.create_task(self.client(index, scenario)) for index in range(self.args.clients)]
+
+        # Ramp up until every client has either connected or failed
+        ramp_start = time.perf_counter()
+        while len(self.connect_times) + self.connect_failures < self.args.clients:
+            await asyncio.sleep(0.1)
+        ramp = time.perf_counter() - ramp_start
+        print(f"{len(self.connect_times)} of {self.args.clients} clients connected in {ramp:.1f}s")
+
+        sampler = ProcessSampler(self.args.pid)
+        sampler.begin()
+        self.measuring = True
+        start = time.perf_counter()
+        await asyncio.sleep(self.args.duration)
+        self.measuring = False
+        elapsed = time.perf_counter() - start
+        processes = sampler.end()
+
+        for client in clients:
+            client.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+
+        return {
+            "connections": {
+                "requested": self.args.clients,
+                "established": len(self.connect_times),
+                "failed": self.connect_failures,
+                "dropped": self.dropped,
+                "peak_open": self.peak_open,
+                "ramp_seconds": round(ramp, 2),
+                "connect_ms": summarize(self.connect_times)
+            },
+            "messages": {
+                "sent": self.sent,
+                "received": self.received,
+                "received_per_sec": round(self.received / elapsed, 1)
+            },
+            "latency_ms": {name: summarize(values) for name, values in self.latencies.items()},
+            "processes": processes
+        }
+
+async def send_periodically(test, index, send):
+    """Senders spread their messages evenly instead of all firing at once."""
+    if index >= test.args.senders:
+        return
+    await asyncio.sleep(random.uniform(0, test.args.interval))
+    seq = 0
+    try:
+        while True:
+            seq += 1
+            await send(seq)
+            if test.measuring:
+                test.sent += 1
+            await asyncio.sleep(test.args.interval)
+    except websockets.ConnectionClosed:
+        pass
+
+# /ws/music: time to the first full state, then latency of track-change and clock messages
+async def music_scenario(test, index, websocket, connect_start):
+    first = True
+    pings = {}
+
+    async def ping(seq):
+        pings[seq] = time.time()
+        await websocket.send(json.dumps({"type": "ping", "client_time": seq}))
+
+    sender = asyncio.create_task(send_periodically(test, index, ping))
+    try:
+        while True:
+            data = json.loads(await test.receive(websocket))
+            now = time.time()
+            if data.get("type") == "music" and first:
+                first = False
+                # Recorded during the ramp-up too: this is what a newly joining listener waits for
+                test.latencies.setdefault("first_state", []).append(time.perf_counter() - connect_start)
+            elif data.get("type") in ("music", "clock"):
+                test.record("broadcast", now - data["server_time"])
+            elif data.get("type") == "pong" and data.get("client_time") in pings:
+                test.record("ping_rtt", now - pings.pop(data["client_time"]))
+    finally:
+        sender.cancel()
+
+# /ws/chat: a few senders, everyone else measures how long each message took to reach them
+async def chat_scenario(test, index, websocket, connect_start):
+    async def send(seq):
+        await websocket.send(json.dumps({"username": f"load-{index}", "message": f"load {seq} t={time.time():.6f}"}))
+
+    sender = asyncio.create_task(send_periodically(test, index, send))
+    try:
+        while True:
+            data = json.loads(await test.receive(websocket))
+            match = TIMESTAMP.search(data.get("message", ""))
+            if match:
+                test.record("broadcast", time.time() - float(match.group(1)))
+    finally:
+        sender.cancel()
+
+# /ws/proxy: mentions go through the admission queue and the AI; answers are broadcast as text
+async def proxy_scenario(test, index, websocket, connect_start):
+    async def send(seq):
+        await websocket.send(f"@ShrokAI load {index}-{seq} t={time.time():.6f}")
+
+    sender = asyncio.create_task(send_periodically(test, index, send))
+    try:
+        while True:
+            message = await test.receive(websocket)
+            now = time.time()
+            reply = REPLY_TIMESTAMP.search(message)
+            if not reply:
+                continue
+            test.record("broadcast", now - float(reply.group(1)))
+            for sent_at in TIMESTAMP.findall(message):
+                test.record("end_to_end", now - float(sent_at))
+            if reply.group(1) not in test.reported_replies:
+                # Stand in for the player, so the proxy doesn't wait out the whole audio length
+                test.reported_replies.add(reply.group(1))
+                await test.report_playback_finished()
+    finally:
+        sender.cancel()
+
+class ProxyLoadTest(LoadTest):
+    def __init__(self, args):
+        super().__init__(args)
+        base = re.sub(r"^ws", "http", args.url.rsplit("/ws/", 1)[0])
+        self.playback_url = f"{base}/playback-finished"
+        self.http = httpx.AsyncClient(timeout=10)
+        self.reported_replies = set()
+
+    async def run(self, scenario):
+        try:
+            return await super().run(scenario)
+        finally:
+            await self.http.aclose()
+
+    async def report_playback_finished(self):
+        try:
+            await self.http.post(self.playback_url)
+        except Exception as e:
+            print(f"Failed to report playback finished: {e!r}")
+
+SCENARIOS = {
+    "music": (LoadTest, music_scenario),
+    "chat": (LoadTest, chat_scenario),
+    "proxy": (ProxyLoadTest, proxy_scenario)
+}
+
+async def run_scenario(args):
+    test_class, scenario = SCENARIOS[args.command]
+    test = test_class(args)
+    results = await test.run(scenario)
+    report = {
+        "scenario": args.command,
+        "label": args.label,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {key: value for key, value in vars(args).items() if key not in ("command", "run", "output")},
+        **results
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"Saved to {args.output}")
+
+def flatten(report, prefix=""):
+    for key, value in report.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+async def compare(args):
+    """Prints every numeric metric of two reports side by side."""
+    reports = []
+    for path in (args.before, args.after):
+        with open(path) as report_file:
+            reports.append(json.load(report_file))
+    before, after = (dict(flatten({key: report[key] for key in report if key != "params"})) for report in reports)
+
+    print(f"{'metric':<40} {'before':>12} {'after':>12} {'change':>9}")
+    for key in before:
+        if key not in after:
+            continue
+        change = f"{(after[key] - before[key]) / before[key] * 100:+.1f}%" if before[key] else ""
+        print(f"{key:<40} {before[key]:>12} {after[key]:>12} {change:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    defaults = {"music": "ws://localhost:8000/ws/music", "chat": "ws://localhost:8000/ws/chat", "proxy": "ws://localhost:9000/ws/proxy"}
+    for name, url in defaults.items():
+        scenario = subcommands.add_parser(name)
+        scenario.add_argument("--url", default=url)
+        scenario.add_argument("--clients", type=int, default=1000)
+        scenario.add_argument("--senders", type=int, default=10, help="Clients that also send (pings for music)")
+        scenario.add_argument("--interval", type=float, default=1.0, help="Seconds between a sender's messages")
+        scenario.add_argument("--duration", type=float, default=60, help="Seconds to measure after the ramp-up")
+        scenario.add_argument("--ramp-concurrency", type=int, default=100, help="Concurrent handshakes while connecting")
+        scenario.add_argument("--connect-timeout", type=float, default=30)
+        scenario.add_argument("--pid", type=int, action="append", default=[], help="Server process to sample")
+        scenario.add_argument("--label", default="", help="e.g. a git revision, stored in the report")
+        scenario.add_argument("--output", help="Where to save the JSON report")
+        scenario.set_defaults(run=run_scenario)
+
+    comparison = subcommands.add_parser("compare", help="Compare two saved reports")
+    comparison.add_argument("before")
+    comparison.add_argument("after")
+    comparison.set_defaults(run=compare)
+
+    args = parser.parse_args()
+    raise_file_limit()
+    asyncio.run(args.run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Stand-ins for the AI and TTS servers, for load tests that shouldn't need a GPU.
+
+They speak the same contracts as the real services: /ws/ai takes {"request_id", "text",
+"session"} (or plain text) and answers with {"processing": true} and then
+{"response", "audio_length"}, both tagged with the request_id; /generate takes
+{"text", "request_id"} and returns {"status", "message", "audio_length", "request_id"}.
+
+    python stubs.py tts --port 5000 --latency 0.8
+    python stubs.py ai --port 8080 --latency 0.5 --tts-url http://localhost:5000/generate
+
+The AI stub echoes the request text followed by "reply=<unix time>", so run.py can
+measure latency all the way to the viewers.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.structured_logging import configure_logging
+
+logger = logging.getLogger(__name__)
+
+def delay(latency, jitter):
+    return max(0.0, latency + random.uniform(-jitter, jitter))
+
+def create_tts_app(latency, jitter, seconds_per_character):
+    app = FastAPI()
+
+    @app.post("/generate")
+    async def generate(request: Request):
+        data = await request.json()
+        text = data.get("text", "")
+        if not text:
+            return JSONResponse({"error": "Text is required"}, status_code=400)
+
+        await asyncio.sleep(delay(latency, jitter))
+        return {
+            "status": "success",
+            "message": "File sent to VPS successfully.",
+            "audio_length": round(len(text) * seconds_per_character, 2),
+            "request_id": data.get("request_id")
+        }
+
+    return app
+
+def create_ai_app(latency, jitter, tts_url, seconds_per_character):
+    app = FastAPI()
+    tts = httpx.AsyncClient(timeout=60) if tts_url else None
+
+    def parse_request(message):
+        try:
+            data = json.loads(message)
+        except json.JSONDecodeError:
+            return message, None
+        if isinstance(data, dict) and "text" in data:
+            return str(data["text"]), data.get("request_id")
+        return message, None
+
+    async def audio_length(text, request_id):
+        if tts is None:
+            return round(len(text) * seconds_per_character, 2)
+        try:
+            response = await tts.post(tts_url, json={"text": text, "request_id": request_id})
+            return response.json().get("audio_length", 0) if response.status_code == 200 else 0
+        except Exception as e:
+            logger.error("[STUB] TTS request failed: %r", e)
+            return 0
+
+    @app.websocket("/ws/ai")
+    async def websocket_endpoint(websocket: WebSocket):
+        await websocket.accept()
+        send_lock = asyncio.Lock()
+        tasks = set()
+
+        async def run_request(message):
+            text, request_id = parse_request(message)
+
+            async def send(data):
+                if request_id is not None:
+                    data["request_id"] = request_id
+                async with send_lock:
+                    await websocket.send_text(json.dumps(data))
+
+            await send({"processing": True})
+            await asyncio.sleep(delay(latency, jitter))
+            length = await audio_length(text, request_id)
+            # Stamped last, so the viewers' latency measures only the proxy's side
+            await send({"response": f"{text} reply={time.time():.6f}", "audio_length": length})
+
+        try:
+            while True:
+                task = asyncio.create_task(run_request(await websocket.receive_text()))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("service", choices=["ai", "tts"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per answer or synthesis")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Random +/- seconds added to the latency")
+    parser.add_argument("--seconds-per-character", type=float, default=0.1, help="Reported audio length per character")
+    parser.add_argument("--tts-url", default="", help="AI stub only: call this /generate for the audio length")
+    args = parser.parse_args()
+    configure_logging(f"{args.service}_stub")
+
+    if args.service == "ai":
+        app = create_ai_app(args.latency, args.jitter, args.tts_url, args.seconds_per_character)
+        port = args.port or 8080
+    else:
+        app = create_tts_app(args.latency, args.jitter, args.seconds_per_character)
+        port = args.port or 5000
+    uvicorn.run(app, host=args.host, port=port, log_level="warning", log_config=None)
+
+if __name__ == "__main__":
+    main()